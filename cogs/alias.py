@@ -2,7 +2,7 @@ from discord.ext import commands
 from .utils.chat_formatting import *
 from .utils.dataIO import dataIO
 from .utils import checks
-from __main__ import user_allowed, send_cmd_help
+from __main__ import send_cmd_help
 from copy import deepcopy
 import os
 import discord
@@ -114,15 +114,15 @@ class Alias:
         if len(message.content) < 2 or message.channel.is_private:
             return
 
-        msg = message.content
         server = message.server
-        prefix = self.get_prefix(server, msg)
+        ctx = self.bot.get_message_context(message)
+        prefix = ctx.prefix
 
         if not prefix:
             return
 
-        if server.id in self.aliases and user_allowed(message):
-            alias = self.first_word(msg[len(prefix):]).lower()
+        if server.id in self.aliases and ctx.allowed:
+            alias = ctx.invoked
             if alias in self.aliases[server.id]:
                 new_command = self.aliases[server.id][alias]
                 args = message.content[len(prefix + alias):]
@@ -163,11 +163,7 @@ class Alias:
         return msg.split(" ")[0]
 
     def get_prefix(self, server, msg):
-        prefixes = self.bot.settings.get_prefixes(server)
-        for p in prefixes:
-            if msg.startswith(p):
-                return p
-        return None
+        return self.bot.settings.get_prefix_matcher(server).match(msg)
 
 
 def check_folder():
@@ -180,12 +176,22 @@ def check_file():
     aliases = {}
 
     f = "data/alias/aliases.json"
-    if not dataIO.is_valid_json(f):
+    if not dataIO.is_valid_json(f, quick=True):
         print("Creating default alias's aliases.json...")
         dataIO.save_json(f, aliases)
 
 
-def setup(bot):
+_prepared = False
+
+
+def prepare():
+    global _prepared
     check_folder()
     check_file()
+    _prepared = True
+
+
+def setup(bot):
+    if not _prepared:
+        prepare()
     bot.add_cog(Alias(bot))
@@ -5,6 +5,7 @@ import os
 from random import shuffle, choice
 from cogs.utils.dataIO import dataIO
 from cogs.utils import checks
+from cogs.utils.profiler import is_installed, timed_import
 from __main__ import send_cmd_help, settings
 import re
 import logging
@@ -21,20 +22,30 @@ __version__ = "0.1.1"
 
 log = logging.getLogger("red.audio")
 
-try:
-    import youtube_dl
-except:
-    youtube_dl = None
-
-try:
-    if not discord.opus.is_loaded():
-        discord.opus.load_opus('libopus-0.dll')
-except OSError:  # Incorrect bitness
-    opus = False
-except:  # Missing opus
-    opus = None
-else:
-    opus = True
+# youtube_dl is slow to import and only needed once a song is looked
+# up, so it's imported then. prepare() loads opus and sets opus to True,
+# False if its bitness is wrong or None if it's missing.
+youtube_dl = None
+opus = None
+
+
+def get_youtube_dl():
+    global youtube_dl
+    if youtube_dl is None:
+        youtube_dl = timed_import("youtube_dl", "audio")
+    return youtube_dl
+
+
+def load_opus():
+    try:
+        if not discord.opus.is_loaded():
+            discord.opus.load_opus('libopus-0.dll')
+    except OSError:  # Incorrect bitness
+        return False
+    except:  # Missing opus
+        return None
+    else:
+        return True
 
 youtube_dl_options = {
     'source_address': '0.0.0.0',
@@ -214,7 +225,7 @@ class Downloader(threading.Thread):
 
     def get_info(self):
         if self._yt is None:
-            self._yt = youtube_dl.YoutubeDL(youtube_dl_options)
+            self._yt = get_youtube_dl().YoutubeDL(youtube_dl_options)
         if "[SEARCH:]" not in self.url:
             video = self._yt.extract_info(self.url, download=False,
                                           process=False)
@@ -626,7 +637,7 @@ class Audio:
             f = os.path.join(f, server, name + ".txt")
         else:
             f = os.path.join(f, name + ".txt")
-        kwargs = dataIO.load_json(f)
+        kwargs = dataIO.load_json(f, cache=True)
 
         kwargs['path'] = f
         kwargs['main_class'] = self
@@ -818,7 +829,7 @@ class Audio:
         f = os.path.join(f, name + ".txt")
         log.debug('checking for {}'.format(f))
 
-        return dataIO.is_valid_json(f)
+        return dataIO.is_valid_json(f, quick=True)
 
     def _playlist_exists_local(self, server, name):
         try:
@@ -830,7 +841,7 @@ class Audio:
         f = os.path.join(f, server, name + ".txt")
         log.debug('checking for {}'.format(f))
 
-        return dataIO.is_valid_json(f)
+        return dataIO.is_valid_json(f, quick=True)
 
     def _remove_queue(self, server):
         if server.id in self.queue:
@@ -1884,7 +1895,7 @@ class Audio:
                     ret[setting] *= 100
         # ^This will make it so that only users with an outdated config will
         # have their volume set * 100. In theory.
-        self.save_settings()
+        dataIO.mark_dirty('data/audio/settings.json', self.settings)
 
         return ret
 
@@ -2081,11 +2092,23 @@ def verify_ffmpeg_avconv():
     else:
         return "avconv"
 
-def setup(bot):
+_player = None
+
+
+def prepare():
+    """Runs the slow part of setup, in a thread when Red starts"""
+    global _player, opus
     check_folders()
     check_files()
+    opus = load_opus()
+    _player = verify_ffmpeg_avconv()
 
-    if youtube_dl is None:
+
+def setup(bot):
+    if _player is None:
+        prepare()
+
+    if not is_installed("youtube_dl"):
         raise RuntimeError("You need to run `pip3 install youtube_dl`")
     if opus is False:
         raise RuntimeError(
@@ -2096,7 +2119,7 @@ def setup(bot):
             "You need to install ffmpeg and opus. See \"https://github.com/"
             "Twentysix26/Red-DiscordBot/wiki/Requirements\"")
 
-    player = verify_ffmpeg_avconv()
+    player = _player
 
     if not player:
         if os.name == "nt":
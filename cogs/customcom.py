@@ -1,7 +1,6 @@
 from discord.ext import commands
 from .utils.dataIO import dataIO
 from .utils import checks
-from __main__ import user_allowed
 import os
 import re
 
@@ -110,14 +109,14 @@ class CustomCommands:
             return
 
         server = message.server
-        prefix = self.get_prefix(message)
+        ctx = self.bot.get_message_context(message)
 
-        if not prefix:
+        if not ctx.prefix:
             return
 
-        if server.id in self.c_commands and user_allowed(message):
+        if server.id in self.c_commands and ctx.allowed:
             cmdlist = self.c_commands[server.id]
-            cmd = message.content[len(prefix):]
+            cmd = ctx.command
             if cmd in cmdlist.keys():
                 cmd = cmdlist[cmd]
                 cmd = self.format_cc(cmd, message)
@@ -127,12 +126,6 @@ class CustomCommands:
                 cmd = self.format_cc(cmd, message)
                 await self.bot.send_message(message.channel, cmd)
 
-    def get_prefix(self, message):
-        for p in self.bot.settings.get_prefixes(message.server):
-            if message.content.startswith(p):
-                return p
-        return False
-
     def format_cc(self, command, message):
         results = re.findall("\{([^}]+)\}", command)
         for result in results:
@@ -172,13 +165,23 @@ def check_folders():
 
 def check_files():
     f = "data/customcom/commands.json"
-    if not dataIO.is_valid_json(f):
+    if not dataIO.is_valid_json(f, quick=True):
         print("Creating empty commands.json...")
         dataIO.save_json(f, {})
 
-def setup(bot):
+_prepared = False
+
+
+def prepare():
+    global _prepared
     check_folders()
     check_files()
+    _prepared = True
+
+
+def setup(bot):
+    if not _prepared:
+        prepare()
     n = CustomCommands(bot)
     bot.add_listener(n.checkCC, "on_message")
     bot.add_cog(n)
@@ -36,9 +36,15 @@ class Downloader:
         self.file_path = "data/downloader/repos.json"
         # {name:{url,cog1:{installed},cog1:{installed}}}
         self.repos = dataIO.load_json(self.file_path)
-        self.executor = ThreadPoolExecutor(NUM_THREADS)
+        self._executor = None
         self._do_first_run()
 
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(NUM_THREADS)
+        return self._executor
+
     def save_repos(self):
         dataIO.save_json(self.file_path, self.repos)
 
@@ -253,7 +259,7 @@ class Downloader:
 
         msg = await self._robust_edit(msg, base_msg + status)
 
-        registry = dataIO.load_json("data/red/cogs.json")
+        registry = dataIO.load_json("data/red/cogs.json", cache=True)
 
         for t in updated_cogs:
             repo, cog, _ = t
@@ -396,7 +402,7 @@ class Downloader:
                 info_file = os.path.join(cogs[cog].get('folder'), "info.json")
                 if os.path.isfile(info_file):
                     try:
-                        data = dataIO.load_json(info_file)
+                        data = dataIO.load_json(info_file, cache=True)
                     except:
                         return None
                     return data
@@ -404,7 +410,7 @@ class Downloader:
             repo_info = os.path.join(self.path, repo_name, 'info.json')
             if os.path.isfile(repo_info):
                 try:
-                    data = dataIO.load_json(repo_info)
+                    data = dataIO.load_json(repo_info, cache=True)
                     return data
                 except:
                     return None
@@ -566,13 +572,23 @@ def check_files():
         {'community': {'url': "https://github.com/Twentysix26/Red-Cogs.git"}}
 
     f = "data/downloader/repos.json"
-    if not dataIO.is_valid_json(f):
+    if not dataIO.is_valid_json(f, quick=True):
         print("Creating default data/downloader/repos.json")
         dataIO.save_json(f, repos)
 
 
-def setup(bot):
+_prepared = False
+
+
+def prepare():
+    global _prepared
     check_folders()
     check_files()
+    _prepared = True
+
+
+def setup(bot):
+    if not _prepared:
+        prepare()
     n = Downloader(bot)
     bot.add_cog(n)
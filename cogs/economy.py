@@ -6,6 +6,7 @@ from datetime import datetime
 from random import randint
 from copy import deepcopy
 from .utils import checks
+from .utils import logqueue
 from __main__ import send_cmd_help
 import os
 import time
@@ -49,8 +50,8 @@ class SameSenderAndReceiver(BankError):
 
 
 class Bank:
-    def __init__(self, bot, file_path):
-        self.accounts = dataIO.load_json(file_path)
+    def __init__(self, bot, directory, legacy_file=None):
+        self.accounts = dataIO.open_sharded(directory, legacy_file)
         self.bot = bot
 
     def create_account(self, user, *, initial_balance=0):
@@ -135,7 +136,6 @@ class Bank:
 
     def wipe_bank(self, server):
         self.accounts[server.id] = {}
-        self._save_bank()
 
     def get_server_accounts(self, server):
         if server.id in self.accounts:
@@ -183,7 +183,8 @@ class Bank:
         return Account(**account)
 
     def _save_bank(self):
-        dataIO.save_json("data/economy/bank.json", self.accounts)
+        # Only the shards of the servers that changed get written
+        self.accounts.mark_dirty()
 
     def _get_account(self, user):
         server = user.server
@@ -200,7 +201,8 @@ class Economy:
     def __init__(self, bot):
         global default_settings
         self.bot = bot
-        self.bank = Bank(bot, "data/economy/bank.json")
+        self.bank = Bank(bot, "data/economy/bank",
+                         legacy_file="data/economy/bank.json")
         self.file_path = "data/economy/settings.json"
         self.settings = dataIO.load_json(self.file_path)
         if "PAYDAY_TIME" in self.settings: #old format
@@ -470,7 +472,7 @@ class Economy:
         server = ctx.message.server
         self.settings[server.id]["SLOT_MIN"] = bid
         await self.bot.say("Minimum bid is now " + str(bid) + " credits.")
-        dataIO.save_json(self.file_path, self.settings)
+        await dataIO.save_json_async(self.file_path, self.settings)
 
     @economyset.command(pass_context=True)
     async def slotmax(self, ctx, bid : int):
@@ -478,7 +480,7 @@ class Economy:
         server = ctx.message.server
         self.settings[server.id]["SLOT_MAX"] = bid
         await self.bot.say("Maximum bid is now " + str(bid) + " credits.")
-        dataIO.save_json(self.file_path, self.settings)
+        await dataIO.save_json_async(self.file_path, self.settings)
 
     @economyset.command(pass_context=True)
     async def slottime(self, ctx, seconds : int):
@@ -486,7 +488,7 @@ class Economy:
         server = ctx.message.server
         self.settings[server.id]["SLOT_TIME"] = seconds
         await self.bot.say("Cooldown is now " + str(seconds) + " seconds.")
-        dataIO.save_json(self.file_path, self.settings)
+        await dataIO.save_json_async(self.file_path, self.settings)
 
     @economyset.command(pass_context=True)
     async def paydaytime(self, ctx, seconds : int):
@@ -494,7 +496,7 @@ class Economy:
         server = ctx.message.server
         self.settings[server.id]["PAYDAY_TIME"] = seconds
         await self.bot.say("Value modified. At least " + str(seconds) + " seconds must pass between each payday.")
-        dataIO.save_json(self.file_path, self.settings)
+        await dataIO.save_json_async(self.file_path, self.settings)
 
     @economyset.command(pass_context=True)
     async def paydaycredits(self, ctx, credits : int):
@@ -502,7 +504,7 @@ class Economy:
         server = ctx.message.server
         self.settings[server.id]["PAYDAY_CREDITS"] = credits
         await self.bot.say("Every payday will now give " + str(credits) + " credits.")
-        dataIO.save_json(self.file_path, self.settings)
+        await dataIO.save_json_async(self.file_path, self.settings)
 
     @economyset.command(pass_context=True)
     async def registercredits(self, ctx, credits : int):
@@ -512,7 +514,7 @@ class Economy:
             credits = 0
         self.settings[server.id]["REGISTER_CREDITS"] = credits
         await self.bot.say("Registering an account will now give {} credits.".format(credits))
-        dataIO.save_json(self.file_path, self.settings)
+        await dataIO.save_json_async(self.file_path, self.settings)
 
     def display_time(self, seconds, granularity=2):  # What would I ever do without stackoverflow?
         intervals = (                                # Source: http://stackoverflow.com/a/24542445
@@ -544,24 +546,32 @@ def check_folders():
 def check_files():
 
     f = "data/economy/settings.json"
-    if not dataIO.is_valid_json(f):
+    if not dataIO.is_valid_json(f, quick=True):
         print("Creating default economy's settings.json...")
         dataIO.save_json(f, {})
 
-    f = "data/economy/bank.json"
-    if not dataIO.is_valid_json(f):
-        print("Creating empty bank.json...")
-        dataIO.save_json(f, {})
 
+_prepared = False
 
-def setup(bot):
-    global logger
+
+def prepare():
+    global _prepared
+    dataIO.set_profile("data/economy/bank/*.json", compact=True,
+                       sort_keys=False)
     check_folders()
     check_files()
+    _prepared = True
+
+
+def setup(bot):
+    global logger
+    if not _prepared:
+        prepare()
     logger = logging.getLogger("red.economy")
     if logger.level == 0:  # Prevents the logger from being loaded again in case of module reload
         logger.setLevel(logging.INFO)
         handler = logging.FileHandler(filename='data/economy/economy.log', encoding='utf-8', mode='a')
         handler.setFormatter(logging.Formatter('%(asctime)s %(message)s', datefmt="[%d/%m/%Y %H:%M]"))
         logger.addHandler(handler)
+        logqueue.queue_logger(logger)
     bot.add_cog(Economy(bot))
@@ -1,5 +1,6 @@
 import discord
 from discord.ext import commands
+from .utils.profiler import is_installed, timed_import
 from random import randint
 import aiohttp
 import random
@@ -19,6 +20,7 @@ class Image:
 
         imgur search [keyword] - Retrieves first hit of search query.
         imgur [subreddit section] [top or new] - Retrieves top 3 hottest or latest pictures of today for given a subreddit section, e.g. 'funny'."""
+        ImgurClient = timed_import("imgurpython", "image").ImgurClient
         imgurclient = ImgurClient("1fd3ef04daf8cab", "f963e574e8e3c17993c933af4f0522e1dc01e230")
         if text == ():
             rand = randint(0, 59) #60 results per generated page
@@ -103,9 +105,6 @@ class ModuleNotFound(Exception):
         return self.message
 
 def setup(bot):
-    global ImgurClient
-    try:
-        from imgurpython import ImgurClient
-    except:
+    if not is_installed("imgurpython"):
         raise ModuleNotFound("imgurpython is not installed. Do 'pip3 install imgurpython' to use this cog.")
     bot.add_cog(Image(bot))
@@ -2,6 +2,7 @@ import discord
 from discord.ext import commands
 from .utils.dataIO import dataIO
 from .utils import checks
+from .utils import logqueue
 from __main__ import send_cmd_help, settings
 from collections import deque, defaultdict
 from cogs.utils.chat_formatting import escape_mass_mentions, box
@@ -41,17 +42,20 @@ class Mod:
         self.whitelist_list = dataIO.load_json("data/mod/whitelist.json")
         self.blacklist_list = dataIO.load_json("data/mod/blacklist.json")
         self.ignore_list = dataIO.load_json("data/mod/ignorelist.json")
+        self._update_access_sets()
         self.filter = dataIO.load_json("data/mod/filter.json")
-        self.past_names = dataIO.load_json("data/mod/past_names.json")
-        self.past_nicknames = dataIO.load_json("data/mod/past_nicknames.json")
+        self.past_names = dataIO.open_journaled("data/mod/past_names.json")
+        self.past_nicknames = dataIO.open_journaled(
+            "data/mod/past_nicknames.json")
         settings = dataIO.load_json("data/mod/settings.json")
         self.settings = defaultdict(lambda: default_settings.copy(), settings)
         self.cache = defaultdict(lambda: deque(maxlen=3))
-        self.cases = dataIO.load_json("data/mod/modlog.json")
+        self.cases = dataIO.open_sharded("data/mod/modlog",
+                                         legacy_file="data/mod/modlog.json")
         self.last_case = defaultdict(dict)
         self._tmp_banned_cache = []
-        perms_cache = dataIO.load_json("data/mod/perms_cache.json")
-        self._perms_cache = defaultdict(dict, perms_cache)
+        # Only read by the mute commands, parsed when first needed
+        self._perms_cache = dataIO.load_lazy("data/mod/perms_cache.json")
 
     @commands.group(pass_context=True, no_pm=True)
     @checks.serverowner_or_permissions(administrator=True)
@@ -149,7 +153,6 @@ class Mod:
         """Resets modlog's cases"""
         server = ctx.message.server
         self.cases[server.id] = {}
-        dataIO.save_json("data/mod/modlog.json", self.cases)
         await self.bot.say("Cases have been reset.")
 
     @modset.command(pass_context=True, no_pm=True)
@@ -308,7 +311,8 @@ class Mod:
             await self.bot.say("That user can't send messages in this "
                                "channel.")
             return
-        self._perms_cache[user.id][channel.id] = overwrites.send_messages
+        user_cache = self._perms_cache.setdefault(user.id, {})
+        user_cache[channel.id] = overwrites.send_messages
         overwrites.send_messages = False
         try:
             await self.bot.edit_channel_permissions(channel, user, overwrites)
@@ -621,26 +625,16 @@ class Mod:
         is_bot = self.bot.user.bot
         has_permissions = channel.permissions_for(server.me).manage_messages
 
-        prefixes = self.bot.command_prefix
-        if isinstance(prefixes, str):
-            prefixes = [prefixes]
-        elif callable(prefixes):
-            if asyncio.iscoroutine(prefixes):
-                await self.bot.say('Coroutine prefixes not yet implemented.')
-                return
-            prefixes = prefixes(self.bot, ctx.message)
-
-        # In case some idiot sets a null prefix
-        if '' in prefixes:
-            prefixes.pop('')
+        matcher = self.bot.settings.get_prefix_matcher(server)
 
         def check(m):
             if m.author.id == self.bot.user.id:
                 return True
             elif m == ctx.message:
                 return True
-            p = discord.utils.find(m.content.startswith, prefixes)
-            if p and len(p) > 0:
+            p = matcher.match(m.content)
+            # In case some idiot sets a null prefix
+            if p:
                 return m.content[len(p):].startswith(tuple(self.bot.commands))
             return False
 
@@ -797,6 +791,7 @@ class Mod:
         if user.id not in self.blacklist_list:
             self.blacklist_list.append(user.id)
             dataIO.save_json("data/mod/blacklist.json", self.blacklist_list)
+            self._update_access_sets()
             await self.bot.say("User has been added to blacklist.")
         else:
             await self.bot.say("User is already blacklisted.")
@@ -807,6 +802,7 @@ class Mod:
         if user.id in self.blacklist_list:
             self.blacklist_list.remove(user.id)
             dataIO.save_json("data/mod/blacklist.json", self.blacklist_list)
+            self._update_access_sets()
             await self.bot.say("User has been removed from blacklist.")
         else:
             await self.bot.say("User is not in blacklist.")
@@ -816,6 +812,7 @@ class Mod:
         """Clears the blacklist"""
         self.blacklist_list = []
         dataIO.save_json("data/mod/blacklist.json", self.blacklist_list)
+        self._update_access_sets()
         await self.bot.say("Blacklist is now empty.")
 
     @commands.group(pass_context=True)
@@ -835,6 +832,7 @@ class Mod:
                 msg = ""
             self.whitelist_list.append(user.id)
             dataIO.save_json("data/mod/whitelist.json", self.whitelist_list)
+            self._update_access_sets()
             await self.bot.say("User has been added to whitelist." + msg)
         else:
             await self.bot.say("User is already whitelisted.")
@@ -845,6 +843,7 @@ class Mod:
         if user.id in self.whitelist_list:
             self.whitelist_list.remove(user.id)
             dataIO.save_json("data/mod/whitelist.json", self.whitelist_list)
+            self._update_access_sets()
             await self.bot.say("User has been removed from whitelist.")
         else:
             await self.bot.say("User is not in whitelist.")
@@ -854,6 +853,7 @@ class Mod:
         """Clears the whitelist"""
         self.whitelist_list = []
         dataIO.save_json("data/mod/whitelist.json", self.whitelist_list)
+        self._update_access_sets()
         await self.bot.say("Whitelist is now empty.")
 
     @commands.group(pass_context=True, no_pm=True)
@@ -874,6 +874,7 @@ class Mod:
             if current_ch.id not in self.ignore_list["CHANNELS"]:
                 self.ignore_list["CHANNELS"].append(current_ch.id)
                 dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                self._update_access_sets()
                 await self.bot.say("Channel added to ignore list.")
             else:
                 await self.bot.say("Channel already in ignore list.")
@@ -881,6 +882,7 @@ class Mod:
             if channel.id not in self.ignore_list["CHANNELS"]:
                 self.ignore_list["CHANNELS"].append(channel.id)
                 dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                self._update_access_sets()
                 await self.bot.say("Channel added to ignore list.")
             else:
                 await self.bot.say("Channel already in ignore list.")
@@ -892,6 +894,7 @@ class Mod:
         if server.id not in self.ignore_list["SERVERS"]:
             self.ignore_list["SERVERS"].append(server.id)
             dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+            self._update_access_sets()
             await self.bot.say("This server has been added to the ignore list.")
         else:
             await self.bot.say("This server is already being ignored.")
@@ -914,6 +917,7 @@ class Mod:
             if current_ch.id in self.ignore_list["CHANNELS"]:
                 self.ignore_list["CHANNELS"].remove(current_ch.id)
                 dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                self._update_access_sets()
                 await self.bot.say("This channel has been removed from the ignore list.")
             else:
                 await self.bot.say("This channel is not in the ignore list.")
@@ -921,6 +925,7 @@ class Mod:
             if channel.id in self.ignore_list["CHANNELS"]:
                 self.ignore_list["CHANNELS"].remove(channel.id)
                 dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                self._update_access_sets()
                 await self.bot.say("Channel removed from ignore list.")
             else:
                 await self.bot.say("That channel is not in the ignore list.")
@@ -932,10 +937,18 @@ class Mod:
         if server.id in self.ignore_list["SERVERS"]:
             self.ignore_list["SERVERS"].remove(server.id)
             dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+            self._update_access_sets()
             await self.bot.say("This server has been removed from the ignore list.")
         else:
             await self.bot.say("This server is not in the ignore list.")
 
+    def _update_access_sets(self):
+        """Mirrors the access lists in sets for user_allowed's lookups"""
+        self.blacklist_set = set(self.blacklist_list)
+        self.whitelist_set = set(self.whitelist_list)
+        self.ignored_servers = set(self.ignore_list["SERVERS"])
+        self.ignored_channels = set(self.ignore_list["CHANNELS"])
+
     def count_ignored(self):
         msg = "```Currently ignoring:\n"
         msg += str(len(self.ignore_list["CHANNELS"])) + " channels\n"
@@ -1110,19 +1123,7 @@ class Mod:
                 pass
 
     def is_mod_or_superior(self, message):
-        user = message.author
-        server = message.server
-        admin_role = settings.get_server_admin(server)
-        mod_role = settings.get_server_mod(server)
-
-        if user.id == settings.owner:
-            return True
-        elif discord.utils.get(user.roles, name=admin_role):
-            return True
-        elif discord.utils.get(user.roles, name=mod_role):
-            return True
-        else:
-            return False
+        return self.bot.get_message_context(message).privileged
 
     async def new_case(self, server, *, action, mod=None, user, reason=None):
         channel = server.get_channel(self.settings[server.id]["mod-log"])
@@ -1170,7 +1171,7 @@ class Mod:
         if mod:
             self.last_case[server.id][mod.id] = case_n
 
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        await self.cases.save_async(server.id)
 
     async def update_case(self, server, *, case, mod, reason):
         channel = server.get_channel(self.settings[server.id]["mod-log"])
@@ -1194,7 +1195,7 @@ class Mod:
                     "**Reason:** {reason}"
                     "".format(**case))
 
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        await self.cases.save_async(server.id)
 
         msg = await self.bot.get_message(channel, case["message"])
         if msg:
@@ -1320,22 +1321,18 @@ class Mod:
                     names = deque(self.past_names[before.id], maxlen=20)
                     names.append(after.name)
                     self.past_names[before.id] = list(names)
-            dataIO.save_json("data/mod/past_names.json", self.past_names)
 
         if before.nick != after.nick and after.nick is not None:
             server = before.server
-            if server.id not in self.past_nicknames:
-                self.past_nicknames[server.id] = {}
-            if before.id in self.past_nicknames[server.id]:
-                nicks = deque(self.past_nicknames[server.id][before.id],
-                              maxlen=20)
+            server_nicks = self.past_nicknames.get(server.id, {})
+            if before.id in server_nicks:
+                nicks = deque(server_nicks[before.id], maxlen=20)
             else:
                 nicks = []
             if after.nick not in nicks:
                 nicks.append(after.nick)
-                self.past_nicknames[server.id][before.id] = list(nicks)
-                dataIO.save_json("data/mod/past_nicknames.json",
-                                 self.past_nicknames)
+                self.past_nicknames.set_path((server.id, before.id),
+                                             list(nicks))
 
     def are_overwrites_empty(self, overwrites):
         """There is currently no cleaner way to check if a
@@ -1364,7 +1361,6 @@ def check_files():
         "past_names.json"     : {},
         "past_nicknames.json" : {},
         "settings.json"       : {},
-        "modlog.json"         : {},
         "perms_cache.json"    : {}
     }
 
@@ -1374,10 +1370,24 @@ def check_files():
             dataIO.save_json("data/mod/{}".format(filename), value)
 
 
-def setup(bot):
-    global logger
+_prepared = False
+
+
+def prepare():
+    global _prepared
+    dataIO.set_profile("data/mod/past_names.json", compact=True,
+                       sort_keys=False)
+    dataIO.set_profile("data/mod/past_nicknames.json", compact=True,
+                       sort_keys=False)
     check_folders()
     check_files()
+    _prepared = True
+
+
+def setup(bot):
+    global logger
+    if not _prepared:
+        prepare()
     logger = logging.getLogger("mod")
     # Prevents the logger from being loaded again in case of module reload
     if logger.level == 0:
@@ -1387,6 +1397,7 @@ def setup(bot):
         handler.setFormatter(
             logging.Formatter('%(asctime)s %(message)s', datefmt="[%d/%m/%Y %H:%M]"))
         logger.addHandler(handler)
+        logqueue.queue_logger(logger)
     n = Mod(bot)
     bot.add_listener(n.check_names, "on_member_update")
     bot.add_cog(n)
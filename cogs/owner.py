@@ -17,6 +17,8 @@ import aiohttp
 
 log = logging.getLogger("red.owner")
 
+IO_STATS_INTERVAL = 300
+
 
 class CogNotFoundError(Exception):
     pass
@@ -47,10 +49,19 @@ class Owner:
         self.setowner_lock = False
         self.file_path = "data/red/disabled_commands.json"
         self.disabled_commands = dataIO.load_json(self.file_path)
-        self.session = aiohttp.ClientSession(loop=self.bot.loop)
+        self._session = None
+        self.io_stats_task = bot.loop.create_task(self.io_stats_dumper())
 
     def __unload(self):
-        self.session.close()
+        if self._session is not None:
+            self._session.close()
+        self.io_stats_task.cancel()
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(loop=self.bot.loop)
+        return self._session
 
     @commands.command()
     @checks.is_owner()
@@ -708,6 +719,13 @@ class Owner:
         embed.add_field(name="Instance owned by", value=str(owner))
         embed.add_field(name="Python", value=py_version)
         embed.add_field(name="discord.py", value=dpy_version)
+        stats = self.bot.stats
+        users = stats.users
+        if users is None:
+            users = await stats.count_users(self.bot.servers)
+        embed.add_field(name="Serving",
+                        value="{} servers, {} channels, {} users".format(
+                            stats.servers, stats.channels, users))
         embed.add_field(name="About Red", value=about, inline=False)
         embed.set_footer(text="Bringing joy since 02 Jan 2016 (over "
                          "{} days ago!)".format(days_since))
@@ -718,6 +736,79 @@ class Owner:
             await self.bot.say("I need the `Embed links` permission "
                                "to send this")
 
+    @commands.command()
+    @checks.is_owner()
+    async def iostats(self, top: int=10):
+        """Shows the data files with the most disk activity
+
+        Times are in milliseconds. The full stats are also saved to
+        data/red/io_stats.json every few minutes."""
+        stats = dataIO.get_stats()
+        if not stats:
+            await self.bot.say("No disk activity recorded yet.")
+            return
+
+        def busy_time(item):
+            s = item[1]
+            return s["load_time"] + s["serialize_time"] + s["write_time"]
+
+        rows = sorted(stats.items(), key=busy_time, reverse=True)[:top]
+        line = "{:<32} {:>6} {:>6} {:>9} {:>8} {:>8} {:>7}\n"
+        msg = line.format("File", "Loads", "Saves", "Written", "Ser ms",
+                          "Write ms", "Max ms")
+        for path, s in rows:
+            if len(path) > 32:
+                path = "..." + path[-29:]
+            msg += line.format(path, s["loads"], s["saves"],
+                               "{:.1f}K".format(s["bytes_written"] / 1024),
+                               "{:.1f}".format(s["serialize_time"] * 1000),
+                               "{:.1f}".format(s["write_time"] * 1000),
+                               "{:.1f}".format(s["max_latency"] * 1000))
+        for page in pagify(msg, ["\n"], shorten_by=16):
+            await self.bot.say(box(page))
+
+    @commands.command()
+    @checks.is_owner()
+    async def dispatchstats(self, top: int=10):
+        """Shows the message queues of the busiest servers
+
+        Only available when Red was started with --dispatcher or
+        --dispatcher-defer. Wait times are in milliseconds."""
+        dispatcher = self.bot.dispatcher
+        if dispatcher is None:
+            await self.bot.say("The message dispatcher is not enabled.")
+            return
+        stats = dispatcher.get_stats()
+        msg = ("Policy: {policy}, workers: {workers}, per server: "
+               "{per_server}, queue size: {queue_size}\n"
+               "Queued: {depth}, deferred: {deferred}, processed: "
+               "{processed}, dropped: {dropped}, over budget: "
+               "{overran} ({overrunning} running, max {max_overrun} per "
+               "server)\n".format(**stats))
+        msg += "Mean wait: {:.1f}, max wait: {:.1f}\n\n".format(
+            stats["mean_wait"] * 1000, stats["max_wait"] * 1000)
+        rows = sorted(stats["servers"].items(),
+                      key=lambda i: (i[1]["depth"], i[1]["processed"]),
+                      reverse=True)[:top]
+        line = "{:<20} {:>6} {:>6} {:>6} {:>9} {:>7}\n"
+        msg += line.format("Server", "Depth", "Defer", "Max", "Processed",
+                           "Dropped")
+        for sid, s in rows:
+            server = self.bot.get_server(sid) if sid is not None else None
+            name = server.name if server is not None else str(sid)
+            msg += line.format(name[:20], s["depth"], s["deferred"],
+                               s["max_depth"], s["processed"], s["dropped"])
+        for page in pagify(msg, ["\n"], shorten_by=16):
+            await self.bot.say(box(page))
+
+    async def io_stats_dumper(self):
+        while True:
+            await asyncio.sleep(IO_STATS_INTERVAL)
+            try:
+                await dataIO.dump_stats()
+            except Exception as e:
+                log.exception(e)
+
     @commands.command()
     async def uptime(self):
         """Shows Red's uptime"""
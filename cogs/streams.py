@@ -397,9 +397,12 @@ class Streams:
 
             if old != (self.twitch_streams, self.hitbox_streams,
                        self.beam_streams):
-                dataIO.save_json("data/streams/twitch.json", self.twitch_streams)
-                dataIO.save_json("data/streams/hitbox.json", self.hitbox_streams)
-                dataIO.save_json("data/streams/beam.json", self.beam_streams)
+                await dataIO.save_json_async("data/streams/twitch.json",
+                                             self.twitch_streams)
+                await dataIO.save_json_async("data/streams/hitbox.json",
+                                             self.hitbox_streams)
+                await dataIO.save_json_async("data/streams/beam.json",
+                                             self.beam_streams)
 
             await asyncio.sleep(CHECK_DELAY)
 
@@ -412,31 +415,41 @@ def check_folders():
 
 def check_files():
     f = "data/streams/twitch.json"
-    if not dataIO.is_valid_json(f):
+    if not dataIO.is_valid_json(f, quick=True):
         print("Creating empty twitch.json...")
         dataIO.save_json(f, [])
 
     f = "data/streams/hitbox.json"
-    if not dataIO.is_valid_json(f):
+    if not dataIO.is_valid_json(f, quick=True):
         print("Creating empty hitbox.json...")
         dataIO.save_json(f, [])
 
     f = "data/streams/beam.json"
-    if not dataIO.is_valid_json(f):
+    if not dataIO.is_valid_json(f, quick=True):
         print("Creating empty beam.json...")
         dataIO.save_json(f, [])
 
     f = "data/streams/settings.json"
-    if not dataIO.is_valid_json(f):
+    if not dataIO.is_valid_json(f, quick=True):
         print("Creating empty settings.json...")
         dataIO.save_json(f, {})
 
 
+_prepared = False
+
+
+def prepare():
+    global _prepared
+    check_folders()
+    check_files()
+    _prepared = True
+
+
 def setup(bot):
     logger = logging.getLogger('aiohttp.client')
     logger.setLevel(50)  # Stops warning spam
-    check_folders()
-    check_files()
+    if not _prepared:
+        prepare()
     n = Streams(bot)
     loop = asyncio.get_event_loop()
     loop.create_task(n.stream_checker())
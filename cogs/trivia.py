@@ -4,11 +4,11 @@ from random import randint
 from random import choice as randchoice
 from .utils.dataIO import dataIO
 from .utils import checks
+from .utils.profiler import is_installed, timed_import
 import datetime
 import time
 import os
 import asyncio
-import chardet
 
 class Trivia:
     """General commands."""
@@ -156,6 +156,7 @@ class TriviaSession():
     def guess_encoding(self, trivia_list):
         with open(trivia_list, "rb") as f:
             try:
+                chardet = timed_import("chardet", "trivia")
                 return chardet.detect(f.read())["encoding"]
             except:
                 return "ISO-8859-1"
@@ -246,8 +247,9 @@ class TriviaSession():
         if message.author.id != trivia_manager.bot.user.id:
             self.timeout = time.perf_counter()
             if self.current_q is not None:
+                ctx = trivia_manager.bot.get_message_context(message)
                 for answer in self.current_q["ANSWERS"]:
-                    if answer in message.content.lower():
+                    if answer in ctx.lowered:
                         self.current_q["ANSWERS"] = []
                         self.status = "correct answer"
                         self.add_point(message.author.name)
@@ -299,10 +301,22 @@ def check_files():
         dataIO.save_json("data/trivia/settings.json", settings)
 
 
-def setup(bot):
-    global trivia_manager
+_prepared = False
+
+
+def prepare():
+    global _prepared
     check_folders()
     check_files()
+    _prepared = True
+
+
+def setup(bot):
+    global trivia_manager
+    if not is_installed("chardet"):
+        raise RuntimeError("You need to run `pip3 install chardet`")
+    if not _prepared:
+        prepare()
     bot.add_listener(check_messages, "on_message")
     trivia_manager = Trivia(bot)
     bot.add_cog(trivia_manager)
@@ -1,6 +1,7 @@
 from discord.ext import commands
 import discord.utils
 from __main__ import settings
+from .settings import MemberCache
 
 #
 # This is a modified version of checks.py, originally made by Rapptz
@@ -48,24 +49,60 @@ def role_or_permissions(ctx, check, **perms):
     role = discord.utils.find(check, author.roles)
     return role is not None
 
+# Results of the role/permission checks below, keyed by (member,
+# channel, check). red.py calls invalidate() on the role, channel and
+# server updates that change what a check sees.
+MEMO_SIZE = 20000
+_memo = MemberCache(MEMO_SIZE)
+
+def invalidate(server, member=None, channel=None):
+    """Drops the memoized check results for a server
+
+    Only those of a member or of a channel if one is passed"""
+    _memo.invalidate(server, member=member, channel=channel)
+
+def clear_memo():
+    _memo.clear()
+
+def _memoized(ctx, check, perms_key, predicate):
+    if is_owner_check(ctx):
+        return predicate(ctx)
+    message = ctx.message
+    server = message.server
+    if server is None:
+        return predicate(ctx)
+    key = (message.author.id, message.channel.id, check, perms_key)
+    return _memo.get(server, key, message.author,
+                     settings.get_resolved(server), lambda: predicate(ctx))
+
+def memoized_check(check, perms):
+    """Wraps a permission predicate so its results are memoized"""
+    def decorator(predicate):
+        perms_key = tuple(sorted(perms.items()))
+        def memo_predicate(ctx):
+            return _memoized(ctx, check, perms_key, predicate)
+        return memo_predicate
+    return decorator
+
 def mod_or_permissions(**perms):
+    @memoized_check("mod", perms)
     def predicate(ctx):
-        server = ctx.message.server
-        mod_role = settings.get_server_mod(server).lower()
-        admin_role = settings.get_server_admin(server).lower()
-        return role_or_permissions(ctx, lambda r: r.name.lower() in (mod_role,admin_role), **perms)
+        resolved = settings.get_resolved(ctx.message.server)
+        roles = (resolved.mod_role_lower, resolved.admin_role_lower)
+        return role_or_permissions(ctx, lambda r: r.name.lower() in roles, **perms)
 
     return commands.check(predicate)
 
 def admin_or_permissions(**perms):
+    @memoized_check("admin", perms)
     def predicate(ctx):
-        server = ctx.message.server
-        admin_role = settings.get_server_admin(server)
-        return role_or_permissions(ctx, lambda r: r.name.lower() == admin_role.lower(), **perms)
+        admin_role = settings.get_resolved(ctx.message.server).admin_role_lower
+        return role_or_permissions(ctx, lambda r: r.name.lower() == admin_role, **perms)
 
     return commands.check(predicate)
 
 def serverowner_or_permissions(**perms):
+    @memoized_check("serverowner", perms)
     def predicate(ctx):
         if ctx.message.server is None:
             return False
@@ -1,55 +1,711 @@
+import asyncio
+import itertools
 import json
 import os
 import logging
-from random import randint
+import math
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from collections.abc import MutableMapping, MutableSequence
+from copy import deepcopy
+from fnmatch import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import rapidjson
+except ImportError:
+    rapidjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# How save_json makes sure the data about to replace a file is sound
+VERIFY_MEMORY = "memory"  # Check the serialized buffer before writing it
+VERIFY_DISK = "disk"      # Read back and parse the tmp file after writing
+
+# How hard atomic writes try to survive a power loss or hard reboot
+DURABILITY_NONE = 0  # Leave flushing to the OS
+DURABILITY_FILE = 1  # fsync the tmp file before it replaces the original
+DURABILITY_DIR = 2   # Also fsync the directory so the rename is persisted
+
+# Tmp files left behind by interrupted saves: the current naming
+# (<file>.<pid>-<n>.tmp) and the legacy one (<file w/o ext>-NNNN.tmp)
+_TMP_FILE = re.compile(r'^(?P<target>.+)\.\d+-\d+\.tmp$')
+_LEGACY_TMP_FILE = re.compile(r'^(?P<base>.+)-\d{4}\.tmp$')
+
+# Serialization profiles, selected per path with DataIO.set_profile
+PRETTY = {"indent": 4, "separators": (',', ' : ')}
+COMPACT = {"indent": None, "separators": (',', ':'), "ensure_ascii": False}
+
+DEFAULT_DB = "data/red/storage.db"
 
 class InvalidFileIO(Exception):
     pass
 
+
+class StorageMigrationError(Exception):
+    pass
+
+
+class JSONBackend:
+    """Stdlib json, the reference every other backend must match"""
+    name = "json"
+
+    def loads(self, raw):
+        return json.loads(raw.decode('utf-8'))
+
+    def dumps(self, data, profile):
+        return json.dumps(data, **profile).encode('utf-8')
+
+
+class FastJSONBackend(JSONBackend):
+    """Base for the optional faster json libraries
+
+    They are only used to write compact profiles, as none of them can
+    reproduce the stdlib's pretty output. Anything they can't encode
+    exactly like the stdlib (e.g. big ints, non-string keys, floats
+    in exponent notation, NaN and Infinity) falls back to it."""
+    _exponent = re.compile(rb'[0-9][eE]')
+    # Set by backends that silently write NaN/Infinity as null
+    nonfinite_as_null = False
+    # Set by backends that read ints past 64 bits as floats. Any run of
+    # digits that long, even inside a string, sends the read to the
+    # stdlib: Discord ids are at most 19 digits, so it stays rare
+    bigint_as_float = False
+    _bigint = re.compile(rb'\d{20}|-\d{19}')
+
+    def loads(self, raw):
+        if self.bigint_as_float and self._bigint.search(raw):
+            return super().loads(raw)
+        try:
+            return self._loads(raw)
+        except ValueError:
+            # Let the stdlib decide: it accepts NaN/Infinity and raises
+            # the JSONDecodeError callers expect for invalid files
+            return super().loads(raw)
+
+    def dumps(self, data, profile):
+        if profile["indent"] is None and not profile.get("ensure_ascii", True):
+            try:
+                payload = self._dumps(data, profile["sort_keys"])
+            except (TypeError, ValueError, OverflowError):
+                pass
+            else:
+                if self._exponent.search(payload):
+                    pass
+                elif (self.nonfinite_as_null and b"null" in payload and
+                        _has_non_finite(data)):
+                    pass
+                else:
+                    return payload
+        return super().dumps(data, profile)
+
+
+class OrjsonBackend(FastJSONBackend):
+    name = "orjson"
+    nonfinite_as_null = True
+    bigint_as_float = True
+
+    def _loads(self, raw):
+        return orjson.loads(raw)
+
+    def _dumps(self, data, sort_keys):
+        option = orjson.OPT_SORT_KEYS if sort_keys else 0
+        return orjson.dumps(data, option=option)
+
+
+class RapidjsonBackend(FastJSONBackend):
+    name = "rapidjson"
+
+    def _loads(self, raw):
+        return rapidjson.loads(raw.decode('utf-8'))
+
+    def _dumps(self, data, sort_keys):
+        return rapidjson.dumps(data, ensure_ascii=False,
+                               sort_keys=sort_keys).encode('utf-8')
+
+
+class UjsonBackend(FastJSONBackend):
+    name = "ujson"
+
+    def _loads(self, raw):
+        return ujson.loads(raw)
+
+    def _dumps(self, data, sort_keys):
+        return ujson.dumps(data, ensure_ascii=False, sort_keys=sort_keys,
+                           escape_forward_slashes=False).encode('utf-8')
+
+
+# Encoded by a fast backend, these must come out identical to the stdlib
+# (fallbacks included). tests/test_dataio_backends.py checks a wider set
+_COMPAT_PROBES = (
+    {"b": [1, -2, 0.5, 1.25, True, False, None], "a": {"": "", "z": []}},
+    {"ctrl": "\x00\x01\x1f\x7f\t\n\r\b\f", "esc": "\"\\/<>&'"},
+    {"text": "caf\u00e9 \u2028\u2029 \U0001f600", "big": 2**53},
+    [12345678901234567, 0.1, -0.0, 3.0, 100.5, [], {}],
+    {"nan": float("nan"), "inf": float("inf"), "-inf": float("-inf"),
+     "none": None},
+    {"huge": 2**64, "tuple": (1, "a"), "1": 1},
+)
+
+
+def _has_non_finite(data):
+    """Checks json-like data for NaN and Infinity floats"""
+    if isinstance(data, float):
+        return not math.isfinite(data)
+    if isinstance(data, dict):
+        return any(_has_non_finite(v) for v in data.values())
+    if isinstance(data, (list, tuple)):
+        return any(_has_non_finite(v) for v in data)
+    return False
+
+
+def _json_copy(data):
+    """Deep copies json-like data, much faster than copy.deepcopy"""
+    if isinstance(data, dict):
+        return {k: _json_copy(v) for k, v in data.items()}
+    if isinstance(data, list):
+        return [_json_copy(v) for v in data]
+    return data
+
+
+def _select_backend():
+    """Returns the fastest available backend matching the stdlib output"""
+    std = JSONBackend()
+    candidates = [(orjson, OrjsonBackend),
+                  (rapidjson, RapidjsonBackend),
+                  (ujson, UjsonBackend)]
+    for module, backend_cls in candidates:
+        if module is None:
+            continue
+        backend = backend_cls()
+        try:
+            for probe in _COMPAT_PROBES:
+                for sort_keys in (True, False):
+                    profile = dict(COMPACT, sort_keys=sort_keys)
+                    expected = std.dumps(probe, profile)
+                    if backend.dumps(probe, profile) != expected:
+                        break
+                    # NaN != NaN, so compare what the loaded data encodes to
+                    if std.dumps(backend.loads(expected), profile) != expected:
+                        break
+                else:
+                    continue
+                break
+            else:
+                return backend
+        except Exception:
+            pass
+    return std
+
 class DataIO():
     def __init__(self):
         self.logger = logging.getLogger("red")
+        self._dirty = {}
+        self._flusher = None
+        self.flush_interval = 5
+        self.io_workers = 4
+        self.verify_mode = VERIFY_MEMORY
+        self.durability = DURABILITY_NONE
+        self._tmp_counter = itertools.count()
+        self._local = threading.local()
+        self._dir_sync = threading.Condition()
+        self._dir_requested = Counter()
+        self._dir_synced = Counter()
+        self._dir_syncing = set()
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self.debug = False
+        self._profiles = []
+        self._profile_cache = {}
+        self.backend = _select_backend()
+        self._sqlite = {}
+        self.cache_size = 128
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._writers = None
+        self._pending = Counter()
+        self._pending_lock = threading.Lock()
 
     def save_json(self, filename, data):
         """Atomically saves json file"""
-        rnd = randint(1000, 9999)
-        path, ext = os.path.splitext(filename)
-        tmp_file = "{}-{}.tmp".format(path, rnd)
-        self._save_json(tmp_file, data)
+        self._dirty.pop(filename, None)
+        payload = self._dump_json(filename, data)
+        if self._pending[filename]:
+            # An async write to this path is still in flight, queue
+            # behind it so it can't overwrite this newer data
+            return self._submit(filename, self._write_json,
+                                filename, payload).result()
+        return self._write_json(filename, payload)
+
+    async def save_json_async(self, filename, data):
+        """Atomically saves json file without blocking the event loop
+
+        The data is serialized before the coroutine yields, so it is
+        safe to keep mutating it afterwards. Writes to the same path
+        are always performed one at a time, in the order requested."""
+        self._dirty.pop(filename, None)
+        payload = self._dump_json(filename, data)
+        future = self._submit(filename, self._write_json, filename, payload)
+        return await asyncio.wrap_future(future)
+
+    async def load_json_async(self, filename):
+        """Loads json file without blocking the event loop
+
+        Pending async writes to the same path are completed first."""
+        future = self._submit(filename, self._read_json, filename)
+        return await asyncio.wrap_future(future)
+
+    def set_profile(self, pattern, *, compact=False, sort_keys=True):
+        """Sets how files whose path matches pattern are serialized
+
+        Pattern is a shell-style wildcard (e.g. data/mod/past_*.json).
+        Compact output drops indentation and padding, disabling
+        sort_keys keeps the insertion order and skips sorting.
+        Files with no matching profile are saved pretty and sorted.
+        When several patterns match, the last one set wins."""
+        pattern = self._normalize_path(pattern)
+        profile = dict(COMPACT if compact else PRETTY, sort_keys=sort_keys)
+        # Cogs set their profiles on setup, don't pile them up on reload
+        self._profiles = [p for p in self._profiles if p[0] != pattern]
+        self._profiles.append((pattern, profile))
+        self._profile_cache.clear()
+
+    def get_profile(self, filename):
+        """Returns the json.dumps arguments used to save filename"""
+        try:
+            return self._profile_cache[filename]
+        except KeyError:
+            pass
+        path = self._normalize_path(filename)
+        profile = dict(PRETTY, sort_keys=True)
+        for pattern, p in reversed(self._profiles):
+            if fnmatch(path, pattern):
+                profile = p
+                break
+        self._profile_cache[filename] = profile
+        return profile
+
+    def mark_dirty(self, filename, data):
+        """Schedules data to be saved to filename by the write-behind flusher
+
+        Repeated calls for the same path before the next flush are
+        coalesced into a single atomic write of the latest data.
+        If write-behind is not running the data is saved right away."""
+        if self._flusher is None:
+            return self.save_json(filename, data)
+        self._dirty[filename] = data
+        return True
+
+    def flush(self):
+        """Synchronously saves every path marked as dirty
+
+        Directory fsyncs are batched: each directory is synced once
+        after all of its files have been written."""
+        self._local.deferred_dirs = set()
+        try:
+            while self._dirty:
+                filename, data = self._dirty.popitem()
+                try:
+                    self.save_json(filename, data)
+                except Exception:
+                    self.logger.exception("Write-behind save of {} has "
+                                          "failed".format(filename))
+        finally:
+            deferred = self._local.deferred_dirs
+            self._local.deferred_dirs = None
+            for directory in deferred:
+                self._sync_dir(directory)
+
+    def start_write_behind(self, loop, interval=None):
+        """Starts the background flusher on the given event loop"""
+        if interval is not None:
+            self.flush_interval = interval
+        if self._flusher is None:
+            self._flusher = loop.create_task(self._flush_loop())
+
+    def stop_write_behind(self):
+        """Stops the background flusher and writes any pending data"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_async()
+
+    async def flush_async(self):
+        """Saves every path marked as dirty without blocking the loop"""
+        futures = []
+        while self._dirty:
+            filename, data = self._dirty.popitem()
+            futures.append(self.save_json_async(filename, data))
+        if futures:
+            results = await asyncio.gather(*futures, return_exceptions=True)
+            for r in results:
+                if isinstance(r, Exception):
+                    self.logger.error("Write-behind save has failed",
+                                      exc_info=r)
+
+    def load_json(self, filename, cache=False):
+        """Loads json file
+
+        With cache the parsed data is kept in memory and reused as long
+        as the file's modification time and size don't change, so
+        repeated loads of an unchanged file only cost a stat call.
+        Each call still returns its own copy, safe to mutate."""
+        if not cache:
+            return self._read_json(filename)
+        key = os.path.abspath(filename)
+        st = os.stat(filename)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._cache.move_to_end(key)
+                return _json_copy(entry[1])
+        data = self._read_json(filename)
+        with self._cache_lock:
+            self._cache[key] = (stamp, data)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return _json_copy(data)
+
+    def _evict(self, filename):
+        with self._cache_lock:
+            self._cache.pop(os.path.abspath(filename), None)
+
+    def open_journaled(self, filename, *, max_journal_size=2**20,
+                       compact_ratio=0.5):
+        """Returns a dict-like view of filename backed by a journal
+
+        Changes are appended to <filename>.journal as small records
+        instead of rewriting the whole file. The journal is folded into
+        a new snapshot once it is bigger than max_journal_size bytes
+        and compact_ratio times the snapshot's size."""
+        return JournaledJSON(filename, self, max_journal_size,
+                             compact_ratio)
+
+    def open_sharded(self, directory, legacy_file=None):
+        """Returns a dict-like view of directory with one file per key
+
+        Meant for data keyed by server id: a shard is only loaded when
+        first accessed and saving a key only rewrites that key's file.
+        If legacy_file (the old single json file) exists, its top-level
+        keys are split into shards and it is renamed to *.migrated"""
+        os.makedirs(directory, exist_ok=True)
+        store = ShardedJSON(directory, self)
+        if legacy_file is not None and os.path.isfile(legacy_file):
+            data = self.load_json(legacy_file)
+            for key, value in data.items():
+                self.save_json(store.shard_path(key), value)
+            os.replace(legacy_file, legacy_file + ".migrated")
+            self.logger.info("Split {} into {} shards in {}"
+                             "".format(legacy_file, len(data), directory))
+        return store
+
+    def open_sqlite(self, filename, db_path=DEFAULT_DB):
+        """Returns a dict-like SQLite view of the data stored for filename
+
+        Each top-level key of the original json file is a row, so
+        updating a key only rewrites that key's value."""
+        return SQLiteStore(self._get_sqlite(db_path), filename, self)
+
+    def migrate_to_sqlite(self, filename, db_path=DEFAULT_DB):
+        """Copies a json file's top-level keys into the SQLite storage
+
+        Only done once: if the storage already holds data for filename
+        this raises StorageMigrationError instead of overwriting it."""
+        data = self.load_json(filename)
+        if not isinstance(data, dict):
+            raise StorageMigrationError("Only json objects can be stored "
+                                        "as key/value rows")
+        store = self.open_sqlite(filename, db_path)
+        if len(store):
+            raise StorageMigrationError("{} has already been migrated"
+                                        "".format(filename))
+        store.update_many(data)
+        return store
+
+    def export_sqlite(self, filename, db_path=DEFAULT_DB, dest=None):
+        """Writes the SQLite data stored for filename back to a json file"""
+        store = self.open_sqlite(filename, db_path)
+        data = {k: _untrack(v) for k, v in store.items()}
+        return self.save_json(dest or filename, data)
+
+    def close_sqlite(self):
+        for conn in self._sqlite.values():
+            conn.close()
+        self._sqlite.clear()
+
+    def _get_sqlite(self, db_path):
+        key = os.path.abspath(db_path)
+        conn = self._sqlite.get(key)
+        if conn is None:
+            conn = sqlite3.connect(db_path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            if self.durability >= DURABILITY_FILE:
+                conn.execute("PRAGMA synchronous=FULL")
+            else:
+                conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS kv ("
+                         "file TEXT NOT NULL, key TEXT NOT NULL, "
+                         "value TEXT NOT NULL, PRIMARY KEY (file, key))")
+            self._sqlite[key] = conn
+        return conn
+
+    def get_stats(self):
+        """Returns a {path: counters dict} snapshot of the I/O stats"""
+        with self._stats_lock:
+            return {path: stats.to_dict()
+                    for path, stats in self.stats.items()}
+
+    async def dump_stats(self, filename="data/red/io_stats.json"):
+        """Saves the I/O stats snapshot to filename"""
+        return await self.save_json_async(filename, self.get_stats())
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats.clear()
+
+    def _get_stats(self, filename):
+        path = self._normalize_path(filename)
         try:
-            self._read_json(tmp_file)
+            return self.stats[path]
+        except KeyError:
+            with self._stats_lock:
+                return self.stats.setdefault(path, IOStats(self._stats_lock))
+
+    def recover_tmp_files(self, root="data"):
+        """Cleans up the tmp files left behind by interrupted saves
+
+        Meant to run at startup, before anything is loaded. When the
+        file a tmp was meant to replace is missing or corrupted and the
+        tmp file holds valid json, the newest such tmp is used to
+        restore it. Every other tmp file is deleted.
+        Returns a (recovered, removed) tuple of file counts."""
+        recovered = removed = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            candidates = {}
+            for name in filenames:
+                target = self._tmp_target(name, filenames)
+                if target is None:
+                    continue
+                tmp = os.path.join(dirpath, name)
+                target = os.path.join(dirpath, target)
+                candidates.setdefault(target, []).append(tmp)
+            for target, tmps in candidates.items():
+                tmps.sort(key=os.path.getmtime, reverse=True)
+                if not self.is_valid_json(target):
+                    for tmp in tmps:
+                        if self.is_valid_json(tmp):
+                            os.replace(tmp, target)
+                            tmps.remove(tmp)
+                            recovered += 1
+                            self.logger.warning("Restored {} from {}"
+                                                "".format(target, tmp))
+                            break
+                for tmp in tmps:
+                    os.remove(tmp)
+                    removed += 1
+        return recovered, removed
+
+    def _tmp_target(self, name, siblings):
+        match = _TMP_FILE.match(name)
+        if match:
+            return match.group("target")
+        match = _LEGACY_TMP_FILE.match(name)
+        if match:
+            # The old naming dropped the extension, look for the original
+            base = match.group("base") + "."
+            for sibling in siblings:
+                if sibling.startswith(base) and not sibling.endswith(".tmp"):
+                    return sibling
+            return base + "json"
+        return None
+
+    def load_lazy(self, filename):
+        """Returns a dict-like view of filename parsed on first access"""
+        return LazyJSON(filename, self)
+
+    def is_valid_json(self, filename, quick=False):
+        """Verifies if json file exists / is readable
+
+        With quick the file isn't parsed: it only has to be non-empty
+        and start and end like a json document"""
+        if quick:
+            return self._looks_like_json(filename)
+        try:
+            self._read_json(filename)
+            return True
+        except FileNotFoundError:
+            return False
         except json.decoder.JSONDecodeError:
+            return False
+
+    def _looks_like_json(self, filename):
+        try:
+            with open(filename, mode="rb") as f:
+                head = f.read(64).lstrip()
+                f.seek(max(f.seek(0, os.SEEK_END) - 64, 0))
+                tail = f.read().rstrip()
+        except (FileNotFoundError, IsADirectoryError):
+            return False
+        if not head or not tail:
+            return False
+        pairs = {b"{": b"}", b"[": b"]", b'"': b'"'}
+        first, last = head[:1], tail[-1:]
+        if first in pairs:
+            return last == pairs[first]
+        # Scalars: numbers, true, false, null
+        return first in b"-0123456789tfn" and last.isalnum()
+
+    def _submit(self, filename, func, *args):
+        """Runs func on the writer thread that owns filename
+
+        Every path is always handled by the same single thread, so
+        operations on a file never interleave while different files
+        can still be written in parallel."""
+        if self._writers is None:
+            self._writers = [ThreadPoolExecutor(max_workers=1)
+                             for i in range(self.io_workers)]
+        key = os.path.abspath(filename)
+        writer = self._writers[hash(key) % len(self._writers)]
+        with self._pending_lock:
+            self._pending[filename] += 1
+        future = writer.submit(func, *args)
+        future.add_done_callback(lambda f: self._release(filename))
+        return future
+
+    def _release(self, filename):
+        with self._pending_lock:
+            self._pending[filename] -= 1
+            if not self._pending[filename]:
+                del self._pending[filename]
+
+    def _write_json(self, filename, payload):
+        start = time.perf_counter()
+        saved = self._write_tmp_and_replace(filename, payload)
+        if saved:
+            self._get_stats(filename).add_write(len(payload),
+                                                time.perf_counter() - start)
+        return saved
+
+    def _write_tmp_and_replace(self, filename, payload):
+        tmp_file = "{}.{}-{}.tmp".format(filename, os.getpid(),
+                                         next(self._tmp_counter))
+        if not self._verify_payload(payload):
+            self.logger.error("Attempted to write file {} but JSON "
+                              "integrity check on the serialized data has "
+                              "failed. The original file is unaltered."
+                              "".format(filename))
+            return False
+        with open(tmp_file, mode="wb") as f:
+            written = f.write(payload)
+            if self.durability >= DURABILITY_FILE:
+                f.flush()
+                os.fsync(f.fileno())
+        try:
+            if written != len(payload):
+                raise OSError("Short write on tmp file")
+            if self.verify_mode == VERIFY_DISK:
+                self._read_json(tmp_file)
+        except (OSError, json.decoder.JSONDecodeError):
             self.logger.exception("Attempted to write file {} but JSON "
                                   "integrity check on tmp file has failed. "
                                   "The original file is unaltered."
                                   "".format(filename))
+            os.remove(tmp_file)
             return False
         os.replace(tmp_file, filename)
+        self._evict(filename)
+        if self.durability >= DURABILITY_DIR:
+            directory = os.path.dirname(os.path.abspath(filename))
+            deferred = getattr(self._local, "deferred_dirs", None)
+            if deferred is not None:
+                deferred.add(directory)
+            else:
+                self._sync_dir(directory)
         return True
 
-    def load_json(self, filename):
-        """Loads json file"""
-        return self._read_json(filename)
+    def _sync_dir(self, directory):
+        """Persists the renames done in directory, with group commit
 
-    def is_valid_json(self, filename):
-        """Verifies if json file exists / is readable"""
+        Writers that replaced a file while another thread's fsync of the
+        same directory was in flight wait for it to end, then a single
+        fsync covers all of them instead of one each."""
+        with self._dir_sync:
+            self._dir_requested[directory] += 1
+            ticket = self._dir_requested[directory]
+            while directory in self._dir_syncing:
+                self._dir_sync.wait()
+            if self._dir_synced[directory] >= ticket:
+                return
+            self._dir_syncing.add(directory)
+            covered = self._dir_requested[directory]
         try:
-            self._read_json(filename)
-            return True
-        except FileNotFoundError:
-            return False
-        except json.decoder.JSONDecodeError:
+            self._fsync_dir(directory)
+        finally:
+            with self._dir_sync:
+                self._dir_syncing.discard(directory)
+                self._dir_synced[directory] = covered
+                self._dir_sync.notify_all()
+
+    def _fsync_dir(self, directory):
+        if os.name == "nt":  # Directories can't be opened on Windows
+            return
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _verify_payload(self, payload):
+        """Validates the serialized data in memory
+
+        The encoder always produces valid JSON, so by default this only
+        guards against an empty buffer. With debug on the buffer is also
+        parsed back, which is still a lot cheaper than a disk round-trip"""
+        if not payload:
             return False
+        if self.debug:
+            try:
+                json.loads(payload.decode('utf-8'))
+            except ValueError:
+                return False
+        return True
 
-    def _read_json(self, filename):
-        with open(filename, encoding='utf-8', mode="r") as f:
-            data = json.load(f)
-        return data
+    def _dump_json(self, filename, data):
+        if isinstance(data, LazyJSON):
+            data = data.data
+        # A value read from a store is a tracking view of the real one
+        data = _untrack(data)
+        start = time.perf_counter()
+        payload = self.backend.dumps(data, self.get_profile(filename))
+        self._get_stats(filename).add_serialize(time.perf_counter() - start)
+        return payload
 
-    def _save_json(self, filename, data):
-        with open(filename, encoding='utf-8', mode="w") as f:
-            json.dump(data, f, indent=4,sort_keys=True,
-                separators=(',',' : '))
+    def _normalize_path(self, path):
+        return os.path.normpath(path).replace(os.sep, "/")
+
+    def _read_json(self, filename):
+        start = time.perf_counter()
+        with open(filename, mode="rb") as f:
+            data = self.backend.loads(f.read())
+        self._get_stats(filename).add_load(time.perf_counter() - start)
         return data
 
     def _legacy_fileio(self, filename, IO, data=None):
@@ -64,6 +720,650 @@ class DataIO():
             raise InvalidFileIO("FileIO was called with invalid"
                 " parameters")
 
+class IOStats:
+    """I/O counters of a single path
+
+    Times are in seconds. The histogram counts saves (serialization
+    excluded) by latency, bucket n holding those that took less than
+    2**n microseconds."""
+    __slots__ = ("_lock", "loads", "saves", "bytes_written", "load_time",
+                 "serialize_time", "write_time", "max_latency", "histogram")
+    BUCKETS = 25  # Last one collects everything slower than ~16s
+
+    def __init__(self, lock):
+        self._lock = lock
+        self.loads = 0
+        self.saves = 0
+        self.bytes_written = 0
+        self.load_time = 0.0
+        self.serialize_time = 0.0
+        self.write_time = 0.0
+        self.max_latency = 0.0
+        self.histogram = [0] * self.BUCKETS
+
+    def add_load(self, elapsed):
+        with self._lock:
+            self.loads += 1
+            self.load_time += elapsed
+            self.max_latency = max(self.max_latency, elapsed)
+
+    def add_serialize(self, elapsed):
+        with self._lock:
+            self.serialize_time += elapsed
+            self.max_latency = max(self.max_latency, elapsed)
+
+    def add_write(self, size, elapsed):
+        bucket = min(int(elapsed * 1000000).bit_length(), self.BUCKETS - 1)
+        with self._lock:
+            self.saves += 1
+            self.bytes_written += size
+            self.write_time += elapsed
+            self.max_latency = max(self.max_latency, elapsed)
+            self.histogram[bucket] += 1
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__
+                if name != "_lock"}
+
+
+def _track(value, notify):
+    """Wraps json containers in views whose changes call notify"""
+    if isinstance(value, dict):
+        return _TrackedNode(value, notify)
+    if isinstance(value, list):
+        return _TrackedList(value, notify)
+    return value
+
+
+def _untrack(value):
+    """Returns the container behind a view, or value itself"""
+    if isinstance(value, (_TrackedNode, _TrackedList)):
+        return value._raw
+    return value
+
+
+class _TrackedNode(MutableMapping):
+    """View of a nested dict reporting the key of every change
+
+    The view is created when the dict is read and changes the dict
+    itself, nothing is copied. Values set through it are stored as
+    they are."""
+    __slots__ = ("_raw", "_notify")
+
+    def __init__(self, raw, notify):
+        self._raw = raw
+        self._notify = notify
+
+    def _wrap(self, key, value):
+        return _track(value, lambda _, key=key: self._notify(key))
+
+    def __getitem__(self, key):
+        return self._wrap(key, self._raw[key])
+
+    def __setitem__(self, key, value):
+        self._raw[key] = _untrack(value)
+        self._notify(key)
+
+    def __delitem__(self, key):
+        del self._raw[key]
+        self._notify(key)
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __contains__(self, key):
+        return key in self._raw
+
+    def __eq__(self, other):
+        return self._raw == _untrack(other)
+
+    def __repr__(self):
+        return repr(self._raw)
+
+    def pop(self, key, *default):
+        had_key = key in self._raw
+        value = self._raw.pop(key, *default)
+        if had_key:
+            self._notify(key)
+        return value
+
+    def popitem(self):
+        key, value = self._raw.popitem()
+        self._notify(key)
+        return key, value
+
+    def clear(self):
+        keys = list(self._raw)
+        self._raw.clear()
+        for k in keys:
+            self._notify(k)
+
+    def copy(self):
+        return self._raw.copy()
+
+    def __copy__(self):
+        return self._raw.copy()
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self._raw, memo)
+
+
+class _TrackedList(MutableSequence):
+    """View of a nested list reporting any change to its parent"""
+    __slots__ = ("_raw", "_notify")
+
+    def __init__(self, raw, notify):
+        self._raw = raw
+        self._notify = notify
+
+    def _child_changed(self, key):
+        self._notify(None)
+
+    def _changed(self):
+        self._notify(None)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._raw[index]
+        return _track(self._raw[index], self._child_changed)
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [_untrack(v) for v in value]
+        else:
+            value = _untrack(value)
+        self._raw[index] = value
+        self._changed()
+
+    def __delitem__(self, index):
+        del self._raw[index]
+        self._changed()
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __iter__(self):
+        return (_track(v, self._child_changed) for v in self._raw)
+
+    def __contains__(self, value):
+        return _untrack(value) in self._raw
+
+    def __eq__(self, other):
+        return self._raw == _untrack(other)
+
+    def __repr__(self):
+        return repr(self._raw)
+
+    def insert(self, index, value):
+        self._raw.insert(index, _untrack(value))
+        self._changed()
+
+    def append(self, value):
+        self._raw.append(_untrack(value))
+        self._changed()
+
+    def extend(self, values):
+        self._raw.extend([_untrack(v) for v in values])
+        self._changed()
+
+    def pop(self, index=-1):
+        value = self._raw.pop(index)
+        self._changed()
+        return value
+
+    def clear(self):
+        self._raw.clear()
+        self._changed()
+
+    def sort(self, *args, **kwargs):
+        self._raw.sort(*args, **kwargs)
+        self._changed()
+
+    def reverse(self):
+        self._raw.reverse()
+        self._changed()
+
+    def __imul__(self, n):
+        self._raw *= n
+        self._changed()
+        return self
+
+    def copy(self):
+        return self._raw.copy()
+
+    def __copy__(self):
+        return self._raw.copy()
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self._raw, memo)
+
+
+class TrackedDict(_TrackedNode):
+    """Dict recording which parts of it changed since the last flush
+
+    Changes are kept in dirty as key paths: (key,) when a top-level key
+    is set, deleted or its value is a list that changed, (key, subkey)
+    when something at or below a second-level key changed.
+    Values are stored as they are and wrapped in tracking views when
+    read, so only changes made through the mapping are recorded: after
+    td[key] = value, mutating value directly still changes the stored
+    data, but nothing marks it dirty. Call mark(key) for that."""
+    __slots__ = ("dirty",)
+
+    def __init__(self, data=None):
+        self.dirty = set()
+        super().__init__(data if data is not None else {}, self.mark)
+
+    def _wrap(self, key, value):
+        return _track(value, lambda subkey, key=key: self.mark(key, subkey))
+
+    def mark(self, key, subkey=None):
+        """Records a change at or below key"""
+        if subkey is None:
+            self.dirty.add((key,))
+        elif (key,) not in self.dirty:
+            self.dirty.add((key, subkey))
+
+    @property
+    def data(self):
+        """The plain dict holding the values"""
+        return self._raw
+
+    @property
+    def dirty_keys(self):
+        """Top-level keys with changes"""
+        return {path[0] for path in self.dirty}
+
+    def pop_dirty(self):
+        """Returns the changed paths and starts tracking anew"""
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def discard_dirty(self, key):
+        """Forgets the changes recorded under a top-level key"""
+        self.dirty = {path for path in self.dirty if path[0] != key}
+
+    def set_clean(self, key, value):
+        """Sets a key without recording it as a change"""
+        self._raw[key] = _untrack(value)
+        self.discard_dirty(key)
+
+
+class LazyJSON(MutableMapping):
+    """Dict-like json file that is only parsed when first accessed
+
+    It can be passed to save_json like the dict it wraps."""
+
+    def __init__(self, filename, dataio):
+        self.filename = filename
+        self._dataio = dataio
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._dataio.load_json(self.filename)
+        return self._data
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        del self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+
+class SQLiteStore(MutableMapping):
+    """Dict-like storage of a json file's top-level keys in SQLite
+
+    Values are decoded once and kept in memory. Assigning to a key
+    persists it right away. Changes made in place through the values
+    it returns are tracked: save_dirty() rewrites the rows that
+    changed, save(key) just one."""
+
+    def __init__(self, conn, filename, dataio):
+        self._conn = conn
+        self.filename = filename
+        self._dataio = dataio
+        self._cache = TrackedDict()
+
+    def __getitem__(self, key):
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        row = self._conn.execute("SELECT value FROM kv WHERE file=? AND "
+                                 "key=?", (self.filename, key)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        value = self._dataio.backend.loads(row[0].encode('utf-8'))
+        self._cache.set_clean(key, value)
+        return self._cache[key]
+
+    def __setitem__(self, key, value):
+        self._write(key, value)
+        self._cache.set_clean(key, value)
+
+    def __delitem__(self, key):
+        cur = self._conn.execute("DELETE FROM kv WHERE file=? AND key=?",
+                                 (self.filename, key))
+        self._cache.pop(key, None)
+        self._cache.discard_dirty(key)
+        if not cur.rowcount:
+            raise KeyError(key)
+
+    def __iter__(self):
+        cur = self._conn.execute("SELECT key FROM kv WHERE file=?",
+                                 (self.filename,))
+        return (row[0] for row in cur.fetchall())
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM kv WHERE file=?",
+                                  (self.filename,)).fetchone()[0]
+
+    def __contains__(self, key):
+        if key in self._cache:
+            return True
+        return self._conn.execute("SELECT 1 FROM kv WHERE file=? AND key=?",
+                                  (self.filename, key)).fetchone() is not None
+
+    def save(self, key):
+        """Persists a value that has been mutated in place"""
+        self._write(key, _untrack(self[key]))
+        self._cache.discard_dirty(key)
+
+    def save_dirty(self):
+        """Persists every value mutated in place since the last save"""
+        keys = {path[0] for path in self._cache.pop_dirty()}
+        self._write_many((k, self._cache.data[k]) for k in keys)
+
+    def update_many(self, data):
+        """Sets several keys in a single transaction"""
+        data = {str(k): v for k, v in data.items()}
+        self._write_many(data.items())
+        for k, v in data.items():
+            self._cache.set_clean(k, v)
+
+    def _write(self, key, value):
+        value = _untrack(value)
+        self._conn.execute("INSERT OR REPLACE INTO kv (file, key, value) "
+                           "VALUES (?, ?, ?)",
+                           (self.filename, key, self._encode(value)))
+
+    def _write_many(self, items):
+        rows = [(self.filename, k, self._encode(_untrack(v)))
+                for k, v in items]
+        if not rows:
+            return
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR REPLACE INTO kv "
+                                   "(file, key, value) VALUES (?, ?, ?)",
+                                   rows)
+
+    def _encode(self, value):
+        profile = dict(COMPACT, sort_keys=False)
+        return self._dataio.backend.dumps(value, profile).decode('utf-8')
+
+
+class ShardedJSON(MutableMapping):
+    """Dict-like storage keeping each top-level key in its own json file
+
+    Shards are loaded on first access and kept in memory. Assigning a
+    key saves its shard. Shards changed in place through the values it
+    returns are tracked and can be persisted with save_dirty() or
+    handed to the write-behind flusher with mark_dirty(); save(key) and
+    save_async(key) save a single one."""
+    _valid_key = re.compile(r'[\w-]+')
+
+    def __init__(self, directory, dataio):
+        self.directory = directory
+        self._dataio = dataio
+        self._shards = TrackedDict()
+
+    def __getitem__(self, key):
+        try:
+            return self._shards[key]
+        except KeyError:
+            pass
+        try:
+            shard = self._dataio.load_json(self.shard_path(key))
+        except FileNotFoundError:
+            raise KeyError(key)
+        self._shards.set_clean(key, shard)
+        return self._shards[key]
+
+    def __setitem__(self, key, value):
+        self._shards.set_clean(key, value)
+        self.save(key)
+
+    def __delitem__(self, key):
+        path = self.shard_path(key)
+        self._shards.pop(key, None)
+        self._shards.discard_dirty(key)
+        self._dataio._dirty.pop(path, None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        keys = set(self._shards)
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            if ext == ".json":
+                keys.add(key)
+        return iter(keys)
+
+    def __len__(self):
+        return len(set(self))
+
+    def __contains__(self, key):
+        if key in self._shards:
+            return True
+        return os.path.isfile(self.shard_path(key))
+
+    def shard_path(self, key):
+        if not isinstance(key, str) or not self._valid_key.fullmatch(key):
+            raise ValueError("{!r} can't be used as a shard name".format(key))
+        return os.path.join(self.directory, key + ".json")
+
+    def save(self, key):
+        """Saves a single shard"""
+        self._shards.discard_dirty(key)
+        return self._dataio.save_json(self.shard_path(key),
+                                      _untrack(self[key]))
+
+    async def save_async(self, key):
+        """Saves a single shard without blocking the event loop"""
+        self._shards.discard_dirty(key)
+        return await self._dataio.save_json_async(self.shard_path(key),
+                                                  _untrack(self[key]))
+
+    def save_dirty(self):
+        """Saves every shard mutated in place since the last save"""
+        for key in {path[0] for path in self._shards.pop_dirty()}:
+            self._dataio.save_json(self.shard_path(key),
+                                   self._shards.data[key])
+
+    def mark_dirty(self, key=None):
+        """Schedules shards for the write-behind flusher
+
+        Without a key, every shard mutated in place since the last
+        save is scheduled."""
+        if key is not None:
+            keys = (key,)
+            self._shards.discard_dirty(key)
+        else:
+            keys = {path[0] for path in self._shards.pop_dirty()}
+        for k in keys:
+            self._dataio.mark_dirty(self.shard_path(k), _untrack(self[k]))
+
+
+class JournaledJSON(MutableMapping):
+    """Dict-like json file persisted as snapshot + append-only journal
+
+    Assigning or deleting a top-level key appends a record right away,
+    nested values can be set the same way with set_path. Changes made
+    in place through the values it returns are tracked: commit()
+    appends one record per changed second-level key, save(key)
+    rewrites a whole top-level value."""
+
+    def __init__(self, filename, dataio, max_journal_size, compact_ratio):
+        self.filename = filename
+        self.journal = filename + ".journal"
+        self._dataio = dataio
+        self.max_journal_size = max_journal_size
+        self.compact_ratio = compact_ratio
+        self._loaded = None
+        self._snapshot_size = 0
+        self._journal_size = 0
+
+    @property
+    def _data(self):
+        # Snapshot and journal are only read when first needed
+        if self._loaded is None:
+            data = self._dataio.load_json(self.filename)
+            self._snapshot_size = os.path.getsize(self.filename)
+            self._replay(data)
+            self._loaded = TrackedDict(data)
+        return self._loaded
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data.set_clean(key, value)
+        self._append({"op": "set", "path": [key],
+                      "value": _untrack(value)})
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self._data.discard_dirty(key)
+        self._append({"op": "del", "path": [key]})
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def set_path(self, path, value):
+        """Sets a nested value, e.g. set_path((server.id, user.id), v)
+
+        Missing intermediate dicts are created."""
+        value = _untrack(value)
+        node = self._data.data
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = value
+        self._append({"op": "set", "path": list(path), "value": value})
+
+    def save(self, key):
+        """Persists a top-level value that has been mutated in place"""
+        self._data.discard_dirty(key)
+        self._append({"op": "set", "path": [key],
+                      "value": _untrack(self[key])})
+
+    def commit(self):
+        """Appends a record for every change made in place"""
+        data = self._data
+        for path in data.pop_dirty():
+            node = data.data
+            for key in path[:-1]:
+                node = node.get(key) if isinstance(node, dict) else None
+            if isinstance(node, dict) and path[-1] in node:
+                record = {"op": "set", "path": list(path),
+                          "value": node[path[-1]]}
+            else:
+                record = {"op": "del", "path": list(path)}
+            self._append(record)
+
+    def compact(self):
+        """Folds the journal into a new snapshot
+
+        The snapshot is replaced atomically before the journal is
+        emptied: if we crash in between, replaying the old journal on
+        the new snapshot yields the same data."""
+        if not self._dataio.save_json(self.filename, self._data.data):
+            return False
+        with open(self.journal, mode="wb"):
+            pass
+        self._data.pop_dirty()
+        self._snapshot_size = os.path.getsize(self.filename)
+        self._journal_size = 0
+        return True
+
+    def _append(self, record):
+        profile = dict(COMPACT, sort_keys=False)
+        line = self._dataio.backend.dumps(record, profile) + b"\n"
+        start = time.perf_counter()
+        with open(self.journal, mode="ab") as f:
+            f.write(line)
+            if self._dataio.durability >= DURABILITY_FILE:
+                f.flush()
+                os.fsync(f.fileno())
+        self._dataio._get_stats(self.journal).add_write(
+            len(line), time.perf_counter() - start)
+        self._journal_size += len(line)
+        if (self._journal_size > self.max_journal_size and
+                self._journal_size > self._snapshot_size * self.compact_ratio):
+            self.compact()
+
+    def _replay(self, data):
+        try:
+            with open(self.journal, mode="rb") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        if lines and not lines[-1].endswith(b"\n"):
+            # A crash mid-append left a partial record: drop it, or the
+            # next append would be glued to it
+            partial = lines.pop()
+            with open(self.journal, mode="r+b") as f:
+                f.truncate(f.seek(0, os.SEEK_END) - len(partial))
+            self._dataio.logger.warning("Dropped a partial record from {}"
+                                        "".format(self.journal))
+        for line in lines:
+            self._journal_size += len(line)
+            try:
+                self._apply(data, self._dataio.backend.loads(line))
+            except (ValueError, KeyError, TypeError):
+                self._dataio.logger.warning("Skipping corrupted record in "
+                                            "{}".format(self.journal))
+
+    def _apply(self, data, record):
+        *parents, key = record["path"]
+        node = data
+        for k in parents:
+            node = node.setdefault(k, {})
+        if record["op"] == "set":
+            node[key] = record["value"]
+        elif record["op"] == "del":
+            node.pop(key, None)
+
+
 def get_value(filename, key):
     with open(filename, encoding='utf-8', mode="r") as f:
         data = json.load(f)
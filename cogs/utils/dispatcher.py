@@ -0,0 +1,194 @@
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+
+log = logging.getLogger("red.dispatcher")
+
+DROP = "drop"
+DEFER = "defer"
+
+
+class _ServerQueue:
+    __slots__ = ("queue", "deferred", "active", "processed", "dropped",
+                 "overran", "overrunning", "max_depth", "flooding")
+
+    def __init__(self):
+        self.queue = deque()
+        self.deferred = deque()
+        self.active = 0       # Workers running or scheduled for it
+        self.processed = 0
+        self.dropped = 0
+        self.overran = 0
+        self.overrunning = 0  # Handlers still running past the budget
+        self.max_depth = 0
+        self.flooding = False
+
+
+class MessageDispatcher:
+    """Runs a message handler through bounded per-server queues
+
+    Each server gets its own queue of at most queue_size messages, and
+    at most per_server of them are handled at the same time. A pool of
+    workers takes turns between the servers that have work, one
+    message at a time, so a flooded server can't starve the others.
+
+    A message only holds its server's slot for time_budget seconds.
+    Past that its handler carries on in the background and the next
+    message goes ahead, so a long command, like a trivia game, doesn't
+    hold up everything sent after it. At most max_overrun handlers of
+    a server may run in the background: past that a slot is held until
+    its handler ends, so a server runs at most per_server + max_overrun
+    handlers at once and its queue still fills up under a flood.
+
+    When a server's queue is full the policy decides what happens to
+    new messages: DROP discards them, DEFER parks them until the queue
+    has room, up to defer_limit messages over all servers. Direct
+    messages use their own queue, under the None key."""
+
+    def __init__(self, loop, handler, *, workers=16, per_server=1,
+                 queue_size=50, policy=DROP, defer_limit=1000,
+                 time_budget=1.0, max_overrun=2):
+        if policy not in (DROP, DEFER):
+            raise ValueError("Unknown policy: {}".format(policy))
+        self.loop = loop
+        self.handler = handler
+        self.workers = workers
+        self.per_server = per_server
+        self.queue_size = queue_size
+        self.policy = policy
+        self.defer_limit = defer_limit
+        self.time_budget = time_budget
+        self.max_overrun = max_overrun
+        self._servers = {}
+        self._ready = None
+        self._tasks = []
+        self._deferred = 0
+        self.max_wait = 0.0
+        self._wait_time = 0.0
+        self._waited = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        if self._ready is None:
+            self._ready = asyncio.Queue()
+        self._tasks = [self.loop.create_task(self._worker())
+                       for i in range(self.workers)]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    def submit(self, message):
+        """Queues a message. Returns False if it was dropped"""
+        sid = message.server.id if message.server is not None else None
+        state = self._servers.get(sid)
+        if state is None:
+            state = self._servers[sid] = _ServerQueue()
+        item = (time.perf_counter(), message)
+        if len(state.queue) >= self.queue_size:
+            if not state.flooding:
+                state.flooding = True
+                log.warning("Message queue of server {} is full, {} new "
+                            "messages".format(sid, "deferring"
+                                              if self.policy == DEFER
+                                              else "dropping"))
+            if (self.policy == DEFER and
+                    self._deferred < self.defer_limit):
+                state.deferred.append(item)
+                self._deferred += 1
+                return True
+            state.dropped += 1
+            return False
+        state.queue.append(item)
+        state.max_depth = max(state.max_depth, len(state.queue))
+        self._schedule(sid, state)
+        return True
+
+    def _schedule(self, sid, state):
+        if state.active < self.per_server and self._ready is not None:
+            state.active += 1
+            self._ready.put_nowait(sid)
+
+    async def _worker(self):
+        while True:
+            sid = await self._ready.get()
+            state = self._servers[sid]
+            if not state.queue:
+                state.active -= 1
+                continue
+            queued_at, message = state.queue.popleft()
+            if state.deferred:
+                state.queue.append(state.deferred.popleft())
+                self._deferred -= 1
+            elif state.flooding and not state.queue:
+                state.flooding = False
+            wait = time.perf_counter() - queued_at
+            self._wait_time += wait
+            self._waited += 1
+            self.max_wait = max(self.max_wait, wait)
+            task = self.loop.create_task(self.handler(message))
+            try:
+                await asyncio.wait((task,), timeout=self.time_budget)
+                if (not task.done() and
+                        state.overrunning >= self.max_overrun):
+                    await asyncio.wait((task,))
+            finally:
+                if task.done():
+                    self._task_done(task)
+                else:
+                    state.overran += 1
+                    state.overrunning += 1
+                    task.add_done_callback(
+                        functools.partial(self._overrun_done, state))
+                state.processed += 1
+                if state.queue:
+                    # Back of the line, so every server gets its turn
+                    self._ready.put_nowait(sid)
+                else:
+                    state.active -= 1
+
+    def _overrun_done(self, state, task):
+        state.overrunning -= 1
+        self._task_done(task)
+
+    def _task_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Error while handling a message",
+                      exc_info=task.exception())
+
+    def get_stats(self):
+        """Returns the totals and the per-server queue metrics"""
+        servers = {}
+        for sid, state in self._servers.items():
+            servers[sid] = {"depth": len(state.queue),
+                            "deferred": len(state.deferred),
+                            "max_depth": state.max_depth,
+                            "processed": state.processed,
+                            "dropped": state.dropped,
+                            "overran": state.overran,
+                            "overrunning": state.overrunning,
+                            "flooding": state.flooding}
+        mean_wait = self._wait_time / self._waited if self._waited else 0.0
+        return {"policy": self.policy,
+                "workers": self.workers,
+                "per_server": self.per_server,
+                "queue_size": self.queue_size,
+                "depth": sum(s["depth"] for s in servers.values()),
+                "deferred": self._deferred,
+                "processed": sum(s["processed"] for s in servers.values()),
+                "dropped": sum(s["dropped"] for s in servers.values()),
+                "overran": sum(s["overran"] for s in servers.values()),
+                "overrunning": sum(s["overrunning"]
+                                   for s in servers.values()),
+                "max_overrun": self.max_overrun,
+                "mean_wait": mean_wait,
+                "max_wait": self.max_wait,
+                "servers": servers}
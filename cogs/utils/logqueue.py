@@ -0,0 +1,102 @@
+import logging
+import logging.handlers
+import queue
+import threading
+
+BUFFER_SIZE = 10000
+
+_listeners = {}
+_lock = threading.Lock()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queues records for a QueueListener without ever blocking
+
+    When the queue is full the record is dropped and counted. The next
+    record that fits is preceded by a warning saying how many were
+    lost."""
+
+    def __init__(self, queue, name):
+        super().__init__(queue)
+        self.name = name
+        self.dropped = 0
+        self._unreported = 0
+
+    def enqueue(self, record):
+        if self._unreported:
+            warning = logging.LogRecord(
+                self.name, logging.WARNING, __file__, 0,
+                "Dropped {} log records, the log buffer was full"
+                "".format(self._unreported), None, None)
+            try:
+                self.queue.put_nowait(self.prepare(warning))
+            except queue.Full:
+                pass
+            else:
+                self._unreported = 0
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # The stock one uses put_nowait, which raises when the buffer is
+        # full. The writer thread is draining it, so waiting is fine
+        self.queue.put(self._sentinel)
+
+
+def queue_logger(logger, buffer_size=None):
+    """Moves the logger's handlers to a background writer thread
+
+    The handlers keep their levels and formatters; the logger gets a
+    DroppingQueueHandler in their place, holding at most buffer_size
+    records (BUFFER_SIZE by default). Calling it again for the same
+    logger only moves the handlers added since. Returns the queue
+    handler."""
+    if isinstance(logger, str):
+        logger = logging.getLogger(logger)
+    with _lock:
+        handlers = [h for h in logger.handlers
+                    if not isinstance(h, DroppingQueueHandler)]
+        current = _listeners.get(logger.name)
+        if current is not None:
+            listener, handler = current
+            if not handlers:
+                return handler
+            listener.stop()
+            handlers = list(listener.handlers) + handlers
+            logger.removeHandler(handler)
+        q = queue.Queue(buffer_size or BUFFER_SIZE)
+        handler = DroppingQueueHandler(q, logger.name)
+        listener = _Listener(q, *handlers, respect_handler_level=True)
+        for h in handlers:
+            logger.removeHandler(h)
+        logger.addHandler(handler)
+        listener.start()
+        _listeners[logger.name] = (listener, handler)
+    return handler
+
+
+def get_dropped():
+    """Returns how many records each queued logger has dropped"""
+    with _lock:
+        return {name: handler.dropped
+                for name, (listener, handler) in _listeners.items()}
+
+
+def stop():
+    """Writes out what's still queued and stops the writer threads
+
+    The handlers go back on their loggers, so whatever is logged
+    afterwards is still written, synchronously."""
+    with _lock:
+        for name, (listener, handler) in _listeners.items():
+            listener.stop()
+            logger = logging.getLogger(name)
+            logger.removeHandler(handler)
+            for h in listener.handlers:
+                logger.addHandler(h)
+        _listeners.clear()
@@ -0,0 +1,117 @@
+import cProfile
+import datetime
+import importlib
+import importlib.util
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from .dataIO import dataIO
+
+REPORT_PATH = "data/red/startup_profile.json"
+CPROFILE_PATH = "data/red/startup.prof"
+HISTORY_SIZE = 50
+
+log = logging.getLogger("red.profiler")
+
+# Seconds spent on the deferred imports of each cog, by module
+import_times = defaultdict(dict)
+
+
+def is_installed(name):
+    """Checks if a module can be imported, without importing it"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def timed_import(name, cog):
+    """Imports a module on first use, recording how long it took
+
+    For the heavy dependencies cogs only import when they need them.
+    The times are in import_times and in the startup report."""
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    elapsed = time.perf_counter() - start
+    if name not in import_times[cog]:
+        import_times[cog][name] = elapsed
+        log.debug("{} imported {} in {:.3f}s".format(cog, name, elapsed))
+    return module
+
+
+class StartupProfiler:
+    """Records how long each phase of Red's startup takes
+
+    Spans are wall-clock times measured from origin, usually the
+    moment red.py started importing its dependencies. When disabled
+    every method is a no-op, so the calls can stay in place.
+
+    finish() writes the report to REPORT_PATH, keeping the totals of
+    the last HISTORY_SIZE runs so regressions stand out, and the
+    cProfile stats to CPROFILE_PATH if they were requested."""
+
+    def __init__(self, origin=None, enabled=False, cprofile=False):
+        self.enabled = enabled
+        self.origin = origin if origin is not None else time.perf_counter()
+        self.spans = []
+        self._open = {}
+        self._profile = None
+        self.finished = False
+        if enabled and cprofile:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def start(self, name):
+        if self.enabled:
+            self._open[name] = time.perf_counter()
+
+    def stop(self, name):
+        if self.enabled and name in self._open:
+            self.add(name, self._open.pop(name), time.perf_counter())
+
+    def add(self, name, start, end):
+        """Records a span that was timed elsewhere"""
+        if self.enabled:
+            self.spans.append((name, start - self.origin, end - start))
+
+    @contextmanager
+    def span(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def finish(self, extra=None):
+        """Writes the report and returns it. Only the first call does"""
+        if not self.enabled or self.finished:
+            return None
+        self.finished = True
+        total = time.perf_counter() - self.origin
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(CPROFILE_PATH)
+        report = {"date": datetime.datetime.now().isoformat(),
+                  "total": total,
+                  "spans": [{"name": n, "start": s, "duration": d}
+                            for n, s, d in self.spans]}
+        report["deferred_imports"] = dict(import_times)
+        if extra:
+            report.update(extra)
+        try:
+            history = dataIO.load_json(REPORT_PATH).get("history", [])
+        except Exception:
+            history = []
+        history.append({"date": report["date"], "total": total})
+        report["history"] = history[-HISTORY_SIZE:]
+        dataIO.save_json(REPORT_PATH, report)
+        return report
+
+    def summary(self, report):
+        lines = ["Startup took {:.2f}s".format(report["total"])]
+        for span in report["spans"]:
+            lines.append("  {:<32} {:>8.3f}s (at {:.3f}s)".format(
+                span["name"], span["duration"], span["start"]))
+        return "\n".join(lines)
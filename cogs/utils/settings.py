@@ -1,14 +1,118 @@
 from .dataIO import dataIO
+from collections import namedtuple
+from contextlib import contextmanager
 import discord
 import os
 
 default_path = "data/red/settings.json"
 
+# Everything the per-message code paths need to know about a server,
+# resolved once. Prefixes are sorted longest first so the first match
+# is always the right one.
+ResolvedServer = namedtuple("ResolvedServer", "prefixes matcher admin_role "
+                            "mod_role admin_role_lower mod_role_lower")
+
+
+class PrefixMatcher:
+    """Finds which of a set of prefixes a message starts with
+
+    Prefixes are bucketed by their first character and tried longest
+    first, so a message only gets compared with the prefixes sharing
+    its first character and the first hit is the right one."""
+
+    __slots__ = ("prefixes", "_buckets", "_empty")
+
+    def __init__(self, prefixes):
+        self.prefixes = sorted(prefixes, key=len, reverse=True)
+        self._empty = "" in self.prefixes
+        buckets = {}
+        for p in self.prefixes:
+            if p:
+                buckets.setdefault(p[0], []).append(p)
+        self._buckets = {c: tuple(b) for c, b in buckets.items()}
+
+    def match(self, content):
+        """Returns the prefix content starts with, or None"""
+        if content:
+            for p in self._buckets.get(content[0], ()):
+                if content.startswith(p):
+                    return p
+        return "" if self._empty else None
+
+
+class MemberCache:
+    """Bounded cache of results that depend on a member's roles
+
+    Entries are grouped by server and keyed by tuples starting with the
+    member's id, optionally followed by a channel's id. Each one holds
+    the member's roles list and the server's resolved settings it was
+    computed with: discord.py gives a member a new list whenever their
+    roles change, and Settings replaces the resolved entry when the
+    admin/mod role is changed, so those invalidate themselves. What
+    changes without touching either (role renames, channel overwrites,
+    server updates) has to be reported with invalidate().
+
+    size bounds the entries of all servers together. When it's
+    reached the whole cache is emptied."""
+
+    __slots__ = ("size", "_servers", "_count")
+
+    def __init__(self, size):
+        self.size = size
+        self._servers = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def get(self, server, key, member, resolved, compute):
+        """Returns the result cached for key, calling compute() if
+        there is none or it's stale"""
+        roles = getattr(member, "roles", None)
+        entries = self._servers.get(server.id)
+        if entries is not None:
+            cached = entries.get(key)
+            if (cached is not None and cached[0] is roles and
+                    cached[1] is resolved):
+                return cached[2]
+        result = compute()
+        if entries is None or key not in entries:
+            if self._count >= self.size:
+                self.clear()
+            entries = self._servers.setdefault(server.id, {})
+            self._count += 1
+        entries[key] = (roles, resolved, result)
+        return result
+
+    def invalidate(self, server, member=None, channel=None):
+        """Drops the results of a server
+
+        Only those of a member or of a channel if one is passed"""
+        if member is None and channel is None:
+            self._count -= len(self._servers.pop(server.id, ()))
+            return
+        entries = self._servers.get(server.id)
+        if not entries:
+            return
+        for key in list(entries):
+            if ((member is not None and key[0] == member.id) or
+                    (channel is not None and key[1:2] == (channel.id,))):
+                del entries[key]
+                self._count -= 1
+
+    def clear(self):
+        self._servers.clear()
+        self._count = 0
+
 
 class Settings:
 
     def __init__(self, path=default_path):
         self.path = path
+        self._resolved = {}
+        self._servers = {}
+        self._batch_depth = 0
+        self._batch_dirty = False
         self.check_folders()
         self.default_settings = {
             "EMAIL": "EmailHere", "PASSWORD": "", "OWNER": "id_here",
@@ -29,7 +133,9 @@ class Settings:
                         print("Adding " + str(key) +
                               " field to red settings.json")
                 dataIO.save_json(self.path, current)
-            self.bot_settings = dataIO.load_json(self.path)
+            self.bot_settings = current
+        self._servers = {k: v for k, v in self.bot_settings.items()
+                         if str(k).isdigit()}
         if "default" not in self.bot_settings:
             self.update_old_settings()
 
@@ -41,8 +147,37 @@ class Settings:
                 os.makedirs(folder)
 
     def save_settings(self):
+        if self._batch_depth:
+            self._batch_dirty = True
+            return
+        self._batch_dirty = False
         dataIO.save_json(self.path, self.bot_settings)
 
+    @contextmanager
+    def batch(self):
+        """Defers the saves of the setters used inside the block
+
+        settings.json is written once on exit, if any setter ran.
+        Blocks can be nested: the outermost one saves. If the
+        block raises nothing is written; the changes stay in memory and
+        go to disk with the next save. Also usable as a decorator."""
+        self._batch_depth += 1
+        try:
+            yield self
+        except:
+            self._batch_depth -= 1
+            raise
+        self._batch_depth -= 1
+        if not self._batch_depth and self._batch_dirty:
+            self.save_settings()
+
+    def invalidate(self, server_id=None):
+        """Drops the resolved settings of a server, or of all of them"""
+        if server_id is None:
+            self._resolved.clear()
+        else:
+            self._resolved.pop(server_id, None)
+
     def update_old_settings(self):
         mod = self.bot_settings["MOD_ROLE"]
         admin = self.bot_settings["ADMIN_ROLE"]
@@ -51,6 +186,7 @@ class Settings:
         self.bot_settings["default"] = {"MOD_ROLE": mod,
                                         "ADMIN_ROLE": admin,
                                         "PREFIXES" : []}
+        self.invalidate()
         self.save_settings()
 
     @property
@@ -88,6 +224,7 @@ class Settings:
     def prefixes(self, value):
         assert isinstance(value, list)
         self.bot_settings["PREFIXES"] = value
+        self.invalidate()
         self.save_settings()
 
     @property
@@ -101,6 +238,7 @@ class Settings:
         if "default" not in self.bot_settings:
             self.update_old_settings()
         self.bot_settings["default"]["ADMIN_ROLE"] = value
+        self.invalidate()
         self.save_settings()
 
     @property
@@ -114,16 +252,13 @@ class Settings:
         if "default" not in self.bot_settings:
             self.update_old_settings()
         self.bot_settings["default"]["MOD_ROLE"] = value
+        self.invalidate()
         self.save_settings()
 
     @property
     def servers(self):
-        ret = {}
-        server_ids = list(
-            filter(lambda x: str(x).isdigit(), self.bot_settings))
-        for server in server_ids:
-            ret.update({server: self.bot_settings[server]})
-        return ret
+        """Server id -> server settings. Shared: don't modify it"""
+        return self._servers
 
     @property
     def login_type(self):
@@ -142,12 +277,7 @@ class Settings:
                                      self.bot_settings["default"]).copy()
 
     def get_server_admin(self, server):
-        if server is None:
-            return self.default_admin
-        assert isinstance(server, discord.Server)
-        if server.id not in self.bot_settings:
-            return self.default_admin
-        return self.bot_settings[server.id].get("ADMIN_ROLE", "")
+        return self.get_resolved(server).admin_role
 
     def set_server_admin(self, server, value):
         if server is None:
@@ -156,15 +286,11 @@ class Settings:
         if server.id not in self.bot_settings:
             self.add_server(server.id)
         self.bot_settings[server.id]["ADMIN_ROLE"] = value
+        self.invalidate(server.id)
         self.save_settings()
 
     def get_server_mod(self, server):
-        if server is None:
-            return self.default_mod
-        assert isinstance(server, discord.Server)
-        if server.id not in self.bot_settings:
-            return self.default_mod
-        return self.bot_settings[server.id].get("MOD_ROLE", "")
+        return self.get_resolved(server).mod_role
 
     def set_server_mod(self, server, value):
         if server is None:
@@ -173,6 +299,7 @@ class Settings:
         if server.id not in self.bot_settings:
             self.add_server(server.id)
         self.bot_settings[server.id]["MOD_ROLE"] = value
+        self.invalidate(server.id)
         self.save_settings()
 
     def get_server_prefixes(self, server):
@@ -187,13 +314,48 @@ class Settings:
         if server.id not in self.bot_settings:
             self.add_server(server.id)
         self.bot_settings[server.id]["PREFIXES"] = prefixes
+        self.invalidate(server.id)
         self.save_settings()
 
     def get_prefixes(self, server):
-        """Returns server's prefixes if set, otherwise global ones"""
+        """Returns server's prefixes if set, otherwise global ones
+
+        They are in the order they were set in. For matching a message
+        use get_prefix_matcher(), which tries them longest first."""
         p = self.get_server_prefixes(server)
         return p if p else self.prefixes
 
+    def get_prefix_matcher(self, server):
+        """Returns the PrefixMatcher for the server's prefixes"""
+        return self.get_resolved(server).matcher
+
+    def get_resolved(self, server):
+        """Returns the server's ResolvedServer, computing it if needed"""
+        sid = server.id if server is not None else None
+        try:
+            return self._resolved[sid]
+        except KeyError:
+            pass
+        if sid is None or sid not in self.bot_settings:
+            admin = self.default_admin
+            mod = self.default_mod
+        else:
+            admin = self.bot_settings[sid].get("ADMIN_ROLE", "")
+            mod = self.bot_settings[sid].get("MOD_ROLE", "")
+        matcher = PrefixMatcher(self.get_server_prefixes(server) or
+                                self.prefixes)
+        resolved = ResolvedServer(prefixes=matcher.prefixes,
+                                  matcher=matcher,
+                                  admin_role=admin,
+                                  mod_role=mod,
+                                  admin_role_lower=admin.lower(),
+                                  mod_role_lower=mod.lower())
+        self._resolved[sid] = resolved
+        return resolved
+
     def add_server(self, sid):
         self.bot_settings[sid] = self.bot_settings["default"].copy()
+        if str(sid).isdigit():
+            self._servers[sid] = self.bot_settings[sid]
+        self.invalidate(sid)
         self.save_settings()
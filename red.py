@@ -7,6 +7,10 @@ import logging.handlers
 import shutil
 import traceback
 import datetime
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+BOOT_TIME = time.perf_counter()
 
 try:
     assert sys.version_info >= (3, 5)
@@ -25,10 +29,13 @@ except AssertionError:
           "https://twentysix26.github.io/Red-Docs/\n")
     sys.exit()
 
-from cogs.utils.settings import Settings
-from cogs.utils.dataIO import dataIO
+from cogs.utils.settings import Settings, MemberCache
+from cogs.utils.dataIO import dataIO, DURABILITY_DIR
 from cogs.utils.chat_formatting import inline
-from collections import Counter
+from cogs.utils.dispatcher import MessageDispatcher, DEFER
+from cogs.utils.profiler import StartupProfiler
+from cogs.utils import logqueue
+from collections import Counter, OrderedDict
 
 #
 # Red, a Discord bot by Twentysix, based on discord.py and its command
@@ -45,27 +52,207 @@ from collections import Counter
 
 description = "Red - A multifunction Discord bot by Twentysix"
 
+COG_LOAD_WORKERS = 8
+
+_MISSING = object()
+
+
+class BotStats:
+    """Server and channel counts, kept up to date by events
+
+    Unique users are only counted when asked for, by count_users(),
+    and the result is kept until a member or server event makes it
+    stale. Nothing is held per user in between: discord.py already
+    keeps the members."""
+
+    USERS_CHUNK = 50  # Servers counted between yields to the event loop
+
+    def __init__(self):
+        self.servers = 0
+        self.channels = 0
+        self.users = None  # Unique users, None until counted or if stale
+        self._version = 0
+
+    def rebuild(self, servers):
+        self.servers = 0
+        self.channels = 0
+        for server in servers:
+            self.add_server(server)
+
+    async def count_users(self, servers):
+        """Counts unique users, letting other tasks run while it does"""
+        version = self._version
+        ids = set()
+        for i, server in enumerate(list(servers), 1):
+            ids.update(member.id for member in server.members)
+            if i % self.USERS_CHUNK == 0:
+                await asyncio.sleep(0)
+        if version == self._version:
+            self.users = len(ids)
+        return len(ids)
+
+    def _users_changed(self):
+        self._version += 1
+        self.users = None
+
+    def add_server(self, server):
+        self.servers += 1
+        self.channels += len(server.channels)
+        self._users_changed()
+
+    def remove_server(self, server):
+        self.servers -= 1
+        self.channels -= len(server.channels)
+        self._users_changed()
+
+    def add_member(self, member):
+        self._users_changed()
+
+    def remove_member(self, member):
+        self._users_changed()
+
+    def add_channel(self, channel):
+        if not channel.is_private:
+            self.channels += 1
+
+    def remove_channel(self, channel):
+        if not channel.is_private:
+            self.channels -= 1
+
+
+class MessageContext:
+    """What the on_message listeners need to know about a message
+
+    Built once per message by Bot.get_message_context and shared by
+    all the listeners. Everything past the prefix is only computed
+    the first time it's asked for."""
+
+    __slots__ = ("bot", "message", "content", "server", "prefix",
+                 "_lowered", "_command", "_invoked", "_privileged",
+                 "_allowed")
+
+    def __init__(self, bot, message):
+        self.bot = bot
+        self.message = message
+        self.content = message.content
+        self.server = message.server
+        matcher = bot.settings.get_prefix_matcher(self.server)
+        self.prefix = matcher.match(self.content)
+        self._lowered = None
+        self._command = _MISSING
+        self._invoked = _MISSING
+        self._privileged = None
+        self._allowed = None
+
+    @property
+    def lowered(self):
+        """The message's content, lowercased"""
+        if self._lowered is None:
+            self._lowered = self.content.lower()
+        return self._lowered
+
+    @property
+    def command(self):
+        """The content after the prefix, None if there's no prefix"""
+        if self._command is _MISSING:
+            if self.prefix is None:
+                self._command = None
+            else:
+                self._command = self.content[len(self.prefix):]
+        return self._command
+
+    @property
+    def invoked(self):
+        """The first word after the prefix, lowercased"""
+        if self._invoked is _MISSING:
+            command = self.command
+            if command is None:
+                self._invoked = None
+            else:
+                self._invoked = command.split(" ")[0].lower()
+        return self._invoked
+
+    @property
+    def privileged(self):
+        """Whether the author is the owner, an admin or a mod"""
+        if self._privileged is None:
+            self._privileged = self.bot.is_privileged(self.message)
+        return self._privileged
+
+    @property
+    def allowed(self):
+        """Whether the bot should respond to the author here"""
+        if self._allowed is None:
+            self._allowed = self.bot._user_allowed(self)
+        return self._allowed
+
+
 
 class Bot(commands.Bot):
     def __init__(self, *args, **kwargs):
 
         def prefix_manager(bot, message):
             """
-            Returns prefixes of the message's server if set.
-            If none are set or if the message's server is None
-            it will return the global prefixes instead.
+            Returns the prefix the message starts with, as a one
+            item list, or an empty list if it doesn't start with any.
+            The server's prefixes are used if set, otherwise the
+            global ones.
 
             Requires a Bot instance and a Message object to be
             passed as arguments.
             """
-            return bot.settings.get_prefixes(message.server)
+            matcher = bot.settings.get_prefix_matcher(message.server)
+            prefix = matcher.match(message.content)
+            return [prefix] if prefix is not None else []
 
         self.counter = Counter()
         self.uptime = datetime.datetime.now()
         self._message_modifiers = []
+        self._message_contexts = OrderedDict()
+        self.message_context_cache = 64
+        self._privileged = MemberCache(10000)
+        self.dispatcher = None
+        self.cog_load_times = {}
+        self.stats = BotStats()
         self.settings = Settings()
         super().__init__(*args, command_prefix=prefix_manager, **kwargs)
 
+    async def logout(self):
+        await super().logout()
+        self.disable_dispatcher()
+        dataIO.stop_write_behind()
+
+    def enable_dispatcher(self, **kwargs):
+        """Routes on_message events through a MessageDispatcher
+
+        The keyword arguments are passed to MessageDispatcher"""
+        self.disable_dispatcher()
+        self.dispatcher = MessageDispatcher(self.loop, self._dispatch_message,
+                                            **kwargs)
+        self.dispatcher.start()
+
+    def disable_dispatcher(self):
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+            self.dispatcher = None
+
+    def dispatch(self, event, *args, **kwargs):
+        if event == "message" and self.dispatcher is not None:
+            # wait_for_message still gets it right away
+            if hasattr(self, "handle_message"):
+                self.handle_message(*args, **kwargs)
+            self.dispatcher.submit(*args)
+            return
+        super().dispatch(event, *args, **kwargs)
+
+    async def _dispatch_message(self, message):
+        coros = []
+        if hasattr(self, "on_message"):
+            coros.append(self._run_event("on_message", message))
+        for func in self.extra_events.get("on_message", ()):
+            coros.append(self._run_extra(func, "on_message", message))
+        await asyncio.gather(*coros)
+
     async def send_message(self, *args, **kwargs):
         if self._message_modifiers:
             if "content" in kwargs:
@@ -127,7 +314,47 @@ class Bot(commands.Bot):
             for page in pages:
                 await bot.send_message(ctx.message.channel, page)
 
+    def get_message_context(self, message):
+        """Returns the message's MessageContext
+
+        The last few contexts are kept, so every on_message listener
+        gets the one the first listener built."""
+        ctx = self._message_contexts.get(message.id)
+        if (ctx is not None and ctx.message is message and
+                ctx.content is message.content):
+            return ctx
+        ctx = MessageContext(self, message)
+        self._message_contexts[message.id] = ctx
+        if len(self._message_contexts) > self.message_context_cache:
+            self._message_contexts.popitem(last=False)
+        return ctx
+
+    def is_privileged(self, message):
+        """Returns True if the author is the owner, an admin or a mod
+
+        The result is cached per member, see MemberCache"""
+        author = message.author
+        if settings.owner == author.id:
+            return True
+        if message.channel.is_private:
+            return False
+        resolved = settings.get_resolved(message.server)
+        names = (resolved.admin_role, resolved.mod_role)
+        return self._privileged.get(
+            message.server, (author.id,), author, resolved,
+            lambda: any(role.name in names for role in author.roles))
+
+    def clear_privileged_cache(self, server=None):
+        if server is None:
+            self._privileged.clear()
+        else:
+            self._privileged.invalidate(server)
+
     def user_allowed(self, message):
+        return self.get_message_context(message).allowed
+
+    def _user_allowed(self, ctx):
+        message = ctx.message
         author = message.author
 
         if author.bot or author == self.user:
@@ -136,31 +363,21 @@ class Bot(commands.Bot):
         mod = self.get_cog('Mod')
 
         if mod is not None:
-            if settings.owner == author.id:
+            if ctx.privileged:
                 return True
-            if not message.channel.is_private:
-                server = message.server
-                names = (settings.get_server_admin(
-                    server), settings.get_server_mod(server))
-                results = map(
-                    lambda name: discord.utils.get(author.roles, name=name),
-                    names)
-                for r in results:
-                    if r is not None:
-                        return True
-
-            if author.id in mod.blacklist_list:
+
+            if author.id in mod.blacklist_set:
                 return False
 
-            if mod.whitelist_list:
-                if author.id not in mod.whitelist_list:
+            if mod.whitelist_set:
+                if author.id not in mod.whitelist_set:
                     return False
 
             if not message.channel.is_private:
-                if message.server.id in mod.ignore_list["SERVERS"]:
+                if message.server.id in mod.ignored_servers:
                     return False
 
-                if message.channel.id in mod.ignore_list["CHANNELS"]:
+                if message.channel.id in mod.ignored_channels:
                     return False
             return True
         else:
@@ -183,8 +400,28 @@ class Formatter(commands.HelpFormatter):
             self._paginator.add_line(shortened)
 
 
+def recover_data():
+    if "--durable" in sys.argv[1:]:
+        dataIO.durability = DURABILITY_DIR
+    with profiler.span("recover_tmp_files"):
+        recovered, removed = dataIO.recover_tmp_files()
+    if recovered or removed:
+        print("Recovered {} and removed {} leftover tmp data files."
+              "".format(recovered, removed))
+
+
 formatter = Formatter(show_check_failure=False)
 
+profiler = StartupProfiler(
+    BOOT_TIME,
+    enabled=any(a.startswith("--profile-startup") for a in sys.argv[1:]),
+    cprofile="--profile-startup-cprofile" in sys.argv[1:])
+
+# Must come before Settings is built: it replaces an unreadable
+# settings.json with the defaults, and the tmp file that could have
+# restored it would then be deleted
+recover_data()
+
 bot = Bot(formatter=formatter, description=description, pm_help=None)
 
 send_cmd_help = bot.send_cmd_help  # Backwards
@@ -192,14 +429,19 @@ user_allowed = bot.user_allowed    # compatibility
 
 settings = bot.settings
 
+from cogs.utils import checks  # Needs settings to be defined
+
 
 @bot.event
 async def on_ready():
+    profiler.stop("connect")
+    profiler.start("on_ready")
     owner_cog = bot.get_cog('Owner')
     total_cogs = len(owner_cog._list_cogs())
-    users = len(set(bot.get_all_members()))
-    servers = len(bot.servers)
-    channels = len([c for c in bot.get_all_channels()])
+    bot.stats.rebuild(bot.servers)
+    servers = bot.stats.servers
+    channels = bot.stats.channels
+    users = await bot.stats.count_users(bot.servers)
     if settings.login_type == "token" and settings.owner == "id_here":
         await set_bot_owner()
     print('------')
@@ -221,6 +463,11 @@ async def on_ready():
         print(url)
         print("------")
     await bot.get_cog('Owner').disable_commands()
+    profiler.stop("on_ready")
+    report = profiler.finish()
+    if report is not None:
+        print(profiler.summary(report))
+        print("Report saved to data/red/startup_profile.json\n")
 
 
 @bot.event
@@ -228,6 +475,70 @@ async def on_command(command, ctx):
     bot.counter["processed_commands"] += 1
 
 
+@bot.event
+async def on_server_role_update(before, after):
+    if before.name != after.name:
+        bot.clear_privileged_cache(after.server)
+    checks.invalidate(after.server)
+
+
+@bot.event
+async def on_server_role_delete(role):
+    bot.clear_privileged_cache(role.server)
+    checks.invalidate(role.server)
+
+
+@bot.event
+async def on_member_update(before, after):
+    if before.roles != after.roles:
+        checks.invalidate(after.server, member=after)
+
+
+@bot.event
+async def on_member_join(member):
+    bot.stats.add_member(member)
+
+
+@bot.event
+async def on_member_remove(member):
+    bot.stats.remove_member(member)
+    checks.invalidate(member.server, member=member)
+
+
+@bot.event
+async def on_channel_create(channel):
+    bot.stats.add_channel(channel)
+
+
+@bot.event
+async def on_channel_update(before, after):
+    if not after.is_private:
+        checks.invalidate(after.server, channel=after)
+
+
+@bot.event
+async def on_channel_delete(channel):
+    bot.stats.remove_channel(channel)
+    if not channel.is_private:
+        checks.invalidate(channel.server, channel=channel)
+
+
+@bot.event
+async def on_server_update(before, after):
+    checks.invalidate(after)
+
+
+@bot.event
+async def on_server_join(server):
+    bot.stats.add_server(server)
+
+
+@bot.event
+async def on_server_remove(server):
+    bot.stats.remove_server(server)
+    checks.invalidate(server)
+
+
 @bot.event
 async def on_message(message):
     bot.counter["messages_read"] += 1
@@ -288,6 +599,7 @@ def check_folders():
             os.makedirs(folder)
 
 
+@settings.batch()
 def check_configs():
     if settings.bot_settings == settings.default_settings:
         print("Red - First run configuration\n")
@@ -399,6 +711,10 @@ def set_logger():
     logger.addHandler(fhandler)
     logger.addHandler(stdout_handler)
 
+    # File and console writes happen on a background thread
+    logqueue.queue_logger("discord")
+    logqueue.queue_logger(logger)
+
 
 def ensure_reply(msg):
     choice = ""
@@ -419,16 +735,40 @@ def get_answer():
 
 
 def set_cog(cog, value):
-    data = dataIO.load_json("data/red/cogs.json")
+    data = dataIO.load_json("data/red/cogs.json", cache=True)
     data[cog] = value
     dataIO.save_json("data/red/cogs.json", data)
 
 
+def preload_cog(extension, executor):
+    """Imports a cog and hands its prepare() hook to executor
+
+    prepare() is where a cog puts the blocking work of its setup that
+    doesn't need the bot. The import itself stays on the calling
+    thread: on Python < 3.10 an asyncio Lock, Queue or Event created at
+    import time binds to the thread's event loop, and worker threads
+    have none. Returns the prepare() future, or None without a hook."""
+    start = time.perf_counter()
+    module = importlib.import_module(extension)
+    profiler.add("import " + extension, start, time.perf_counter())
+    prepare = getattr(module, "prepare", None)
+    if prepare is None:
+        return None
+    return executor.submit(run_timed, prepare)
+
+
+def run_timed(func):
+    """Calls func, returning when it started and ended"""
+    start = time.perf_counter()
+    func()
+    return start, time.perf_counter()
+
+
 def load_cogs():
     no_prompt = "--no-prompt" in sys.argv[1:]
 
     try:
-        registry = dataIO.load_json("data/red/cogs.json")
+        registry = dataIO.load_json("data/red/cogs.json", cache=True)
     except:
         registry = {}
 
@@ -444,6 +784,7 @@ def load_cogs():
         exit(1)
 
     failed = []
+    to_load = []
     extensions = owner_cog._list_cogs()
     for extension in extensions:
         if extension.lower() == "cogs.owner":
@@ -461,13 +802,57 @@ def load_cogs():
             registry[extension] = True
         if not registry[extension]:
             continue
+        to_load.append(extension)
+
+    # Cogs are imported up front and their prepare() hooks run in
+    # threads while the next ones import. setup() stays serial and in
+    # order, starting as soon as its own cog is ready
+    start = time.perf_counter()
+    preloads = {}
+    executor = None
+    if to_load and "--serial-load" not in sys.argv[1:]:
+        executor = ThreadPoolExecutor(min(COG_LOAD_WORKERS, len(to_load)))
+        for extension in to_load:
+            try:
+                preloads[extension] = preload_cog(extension, executor)
+            except Exception as e:
+                preloads[extension] = e
+
+    for extension in to_load:
+        setup_start = time.perf_counter()
         try:
-            owner_cog._load_cog(extension)
+            if extension in preloads:
+                future = preloads[extension]
+                if isinstance(future, Exception):
+                    raise future
+                prepare_time = 0.0
+                if future is not None:
+                    prepare_start, prepare_end = future.result()
+                    prepare_time = prepare_end - prepare_start
+                    profiler.add("prepare " + extension, prepare_start,
+                                 prepare_end)
+                setup_start = time.perf_counter()
+                bot.load_extension(extension)
+            else:
+                prepare_time = 0.0
+                owner_cog._load_cog(extension)
         except Exception as e:
             print("{}: {}".format(e.__class__.__name__, str(e)))
             logger.exception(e)
             failed.append(extension)
             registry[extension] = False
+        else:
+            setup_end = time.perf_counter()
+            setup_time = setup_end - setup_start
+            profiler.add("setup " + extension, setup_start, setup_end)
+            bot.cog_load_times[extension] = (prepare_time, setup_time)
+            logger.debug("Loaded {} (prepare {:.3f}s, setup {:.3f}s)"
+                         "".format(extension, prepare_time, setup_time))
+    if executor is not None:
+        executor.shutdown(wait=True)
+    if to_load:
+        print("Loaded {} cogs in {:.2f}s".format(len(to_load) - len(failed),
+                                                 time.perf_counter() - start))
 
     if extensions:
         dataIO.save_json("data/red/cogs.json", registry)
@@ -484,10 +869,20 @@ def load_cogs():
 def main():
     global settings
 
-    check_folders()
-    check_configs()
-    set_logger()
-    owner_cog = load_cogs()
+    profiler.add("imports", BOOT_TIME, time.perf_counter())
+    with profiler.span("check_folders"):
+        check_folders()
+    if "--dispatcher-defer" in sys.argv[1:]:
+        bot.enable_dispatcher(policy=DEFER)
+    elif "--dispatcher" in sys.argv[1:]:
+        bot.enable_dispatcher()
+    with profiler.span("check_configs"):
+        check_configs()
+    with profiler.span("set_logger"):
+        set_logger()
+    dataIO.start_write_behind(bot.loop)
+    with profiler.span("load_cogs"):
+        owner_cog = load_cogs()
     if settings.prefixes == []:
         print("No prefix set. Defaulting to !")
         settings.prefixes = ["!"]
@@ -509,10 +904,13 @@ def main():
         print("and: pip3 install -U git+https://github.com/Rapptz/"
               "discord.py@master#egg=discord.py[voice]")
     print("Official server: https://discord.me/Red-DiscordBot")
+    profiler.start("login")
     if settings.login_type == "token":
         yield from bot.login(settings.email)
     else:
         yield from bot.login(settings.email, settings.password)
+    profiler.stop("login")
+    profiler.start("connect")
     yield from bot.connect()
 
 if __name__ == '__main__':
@@ -540,6 +938,9 @@ if __name__ == '__main__':
         logger.error(traceback.format_exc())
         loop.run_until_complete(bot.logout())
     finally:
+        dataIO.stop_write_behind()
+        dataIO.close_sqlite()
+        logqueue.stop()
         loop.close()
         if error:
             exit(1)
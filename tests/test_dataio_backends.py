@@ -0,0 +1,89 @@
+"""The fast json backends must write and read exactly like the stdlib"""
+import json
+
+import pytest
+
+from cogs.utils import dataIO as dataio_module
+from cogs.utils.dataIO import (COMPACT, PRETTY, JSONBackend, OrjsonBackend,
+                               RapidjsonBackend, UjsonBackend, DataIO)
+
+BACKENDS = [
+    pytest.param(OrjsonBackend, marks=pytest.mark.skipif(
+        dataio_module.orjson is None, reason="orjson not installed")),
+    pytest.param(RapidjsonBackend, marks=pytest.mark.skipif(
+        dataio_module.rapidjson is None, reason="rapidjson not installed")),
+    pytest.param(UjsonBackend, marks=pytest.mark.skipif(
+        dataio_module.ujson is None, reason="ujson not installed")),
+]
+
+NAN = float("nan")
+INF = float("inf")
+
+CORPUS = [
+    # Plain values
+    {"b": [1, -2, 0.5, 1.25, True, False, None], "a": {"": "", "z": []}},
+    [0, -0.0, 3.0, 0.1, 100.5, 1 / 3, 2.5e-5, 1e16, 1e-7, 123456789.125],
+    # Non-finite floats, alone, nested and next to real nulls
+    {"nan": NAN, "inf": INF, "-inf": -INF},
+    [NAN], [INF, None], {"a": {"b": [1, (2, -INF)]}, "c": None},
+    # Ints around and past 64 bits
+    [2**53, 2**53 + 1, 2**63 - 1, 2**63, 2**64 - 1, 2**64, 2**100],
+    [-2**63, -2**63 - 1, -2**64, -2**100],
+    {"id": 12345678901234567890123, "ids": ["123456789012345678"]},
+    # Non-string keys
+    {1: "a", 2: "b", 10: "c"},
+    {1.5: "a", 2.5: "b"},
+    {True: 1, False: 0},
+    {None: 1},
+    {"1": 1, "nested": {3: [4], 4: {5: 6}}},
+    # Tuples
+    (1, 2, 3), {"t": (1, ("a", None), [])}, ((),),
+    # Strings
+    {"ctrl": "\x00\x01\x1f\x7f\t\n\r\b\f", "esc": "\"\\/<>&'"},
+    {"text": "caf\u00e9 \u2028\u2029 \U0001f600 \ud7ff \ue000"},
+    {"": "", " ": " ", "kéy": "väl"},
+    # Containers
+    [], {}, [[[]]], [{}], {"a": {"b": {"c": {}}}},
+]
+
+
+def profiles():
+    for sort_keys in (True, False):
+        yield dict(COMPACT, sort_keys=sort_keys)
+        yield dict(PRETTY, sort_keys=sort_keys)
+
+
+@pytest.mark.parametrize("backend_cls", BACKENDS)
+@pytest.mark.parametrize("data", CORPUS, ids=repr)
+def test_dumps_matches_stdlib(backend_cls, data):
+    std = JSONBackend()
+    backend = backend_cls()
+    for profile in profiles():
+        assert backend.dumps(data, profile) == std.dumps(data, profile)
+
+
+@pytest.mark.parametrize("backend_cls", BACKENDS)
+@pytest.mark.parametrize("data", CORPUS, ids=repr)
+def test_loads_matches_stdlib(backend_cls, data):
+    std = JSONBackend()
+    backend = backend_cls()
+    for profile in profiles():
+        raw = std.dumps(data, profile)
+        # NaN != NaN, so compare what the loaded data encodes to
+        assert (std.dumps(backend.loads(raw), profile) ==
+                std.dumps(std.loads(raw), profile))
+
+
+@pytest.mark.parametrize("backend_cls", BACKENDS)
+def test_loads_invalid_raises_like_stdlib(backend_cls):
+    with pytest.raises(json.JSONDecodeError):
+        backend_cls().loads(b'{"a": ')
+
+
+def test_save_json_keeps_non_finite_floats(tmp_path):
+    io = DataIO()
+    path = str(tmp_path / "data.json")
+    io.set_profile(str(tmp_path / "*.json"), compact=True)
+    io.save_json(path, {"a": NAN, "b": INF, "c": None})
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == '{"a":NaN,"b":Infinity,"c":null}'
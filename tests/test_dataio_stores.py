@@ -0,0 +1,61 @@
+"""Values set on the stores are kept as they are and saved with changes"""
+from cogs.utils.dataIO import DataIO, TrackedDict
+
+
+def test_assignment_keeps_the_callers_object():
+    data = TrackedDict()
+    value = {"a": 1}
+    data["k"] = value
+    value["x"] = 2
+    assert data.data["k"] is value
+    assert data["k"] == {"a": 1, "x": 2}
+
+
+def test_changes_through_views_are_tracked():
+    data = TrackedDict({"srv": {"user": {"balance": 1}}, "names": ["a"]})
+    data["srv"]["user"]["balance"] += 5
+    data["names"].append("b")
+    assert data.pop_dirty() == {("srv", "user"), ("names",)}
+    assert data.data == {"srv": {"user": {"balance": 6}},
+                         "names": ["a", "b"]}
+
+
+def test_sharded_saves_mutated_values(tmp_path):
+    io = DataIO()
+    store = io.open_sharded(str(tmp_path))
+    value = {}
+    store["srv"] = value
+    value["x"] = 2
+    store.save("srv")
+    store["srv"]["y"] = 3
+    store.save_dirty()
+    assert io.load_json(str(tmp_path / "srv.json")) == {"x": 2, "y": 3}
+
+
+def test_journaled_save_before_first_access(tmp_path):
+    io = DataIO()
+    path = str(tmp_path / "names.json")
+    io.save_json(path, {"k": [1]})
+    io.open_journaled(path).save("k")
+    store = io.open_journaled(path)
+    store["k"].append(2)
+    store.commit()
+    assert io.open_journaled(path)["k"] == [1, 2]
+
+
+def test_sqlite_migrate_mutate_export(tmp_path):
+    io = DataIO()
+    path = str(tmp_path / "bank.json")
+    db = str(tmp_path / "red.db")
+    io.save_json(path, {"srv": {"user": {"balance": 1}}, "names": ["a"]})
+    store = io.migrate_to_sqlite(path, db)
+    store["srv"]["user"]["balance"] += 5
+    store["names"].append("b")
+    store.save_dirty()
+    dest = str(tmp_path / "export.json")
+    assert io.export_sqlite(path, db, dest=dest)
+    assert io.load_json(dest) == {"srv": {"user": {"balance": 6}},
+                                  "names": ["a", "b"]}
+    io.save_json(dest, store["srv"])
+    assert io.load_json(dest) == {"user": {"balance": 6}}
+    io.close_sqlite()